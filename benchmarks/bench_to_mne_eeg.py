@@ -0,0 +1,75 @@
+'''Benchmark of musestudio.to_mne_eeg on synthetic multi-hour Muse EEG streams.
+
+Compares the current conversion with the per-sample reordering used before
+(list comprehension over every sample and np.array(...).T) and checks that both
+produce the same data.
+
+Usage:
+    python benchmarks/bench_to_mne_eeg.py --hours 1 2 4 --streams 2
+'''
+import argparse
+import numpy as np
+from mne import channels, create_info, io, set_log_level
+from musestudio import to_mne_eeg
+from time import perf_counter
+
+CHANNELS = ['TP9', 'AF7', 'AF8', 'TP10', 'Right AUX']
+SFREQ = 256
+
+def make_eeg_stream(hours, device = 'Muse-0000', seed = 0):
+    '''Create a stream dict shaped like the EEG streams returned by read_raw_xdf.'''
+    n_samples = int(hours * 3600 * SFREQ)
+    rng = np.random.default_rng(seed)
+    return {
+        'info': {
+            'name': [device],
+            'type': ['EEG'],
+            'nominal_srate': [str(SFREQ)],
+            'desc': [{'channels': [{'channel': [{'label': [label]} for label in CHANNELS]}]}]
+        },
+        'time_series': (rng.standard_normal((n_samples, len(CHANNELS))) * 50 + 800).astype(np.float32),
+        'time_stamps': np.arange(n_samples) / SFREQ
+    }
+
+def legacy_to_mne_eeg(eegstream, line_freq):
+    '''Conversion as it was done before vectorizing to_mne_eeg.'''
+    raweeg = []
+    ch_names = [eegstream[0]['info']['desc'][0]['channels'][0]['channel'][i]['label'][0] for i in range(len(eegstream[0]['time_series'][0]))]
+    sensor_coord = [[-0.0856192, -0.0465147, -0.0457070], [-0.0548397, 0.0685722, -0.0105900], [0.0557433, 0.0696568, -0.0107550], [0.0861618, -0.0470353, -0.0458690]]
+    for stream in eegstream:
+        dig_montage = channels.make_dig_montage(ch_pos=dict(zip(ch_names, sensor_coord)), coord_frame='head')
+        info = create_info(ch_names=dig_montage.ch_names, sfreq=float(stream['info']['nominal_srate'][0]), ch_types='eeg')
+        info.set_montage(dig_montage)
+        conv_data = stream['time_series'] * 1e-6
+        ord_data = [[sublist[1][item] for item in [1, 2, 3, 0]] for sublist in enumerate(conv_data)]
+        raw = io.RawArray(np.array(ord_data).T, info)
+        raw.info['line_freq'] = line_freq
+        raweeg.append(raw)
+    return raweeg
+
+def timeit(function, *args):
+    '''Run a function once and return its result and wall time.'''
+    start = perf_counter()
+    result = function(*args)
+    return result, perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hours', type=float, nargs='+', default=[1, 2, 4], help='duration of every synthetic recording')
+    parser.add_argument('--streams', type=int, default=2, help='number of recordings converted together')
+    args = parser.parse_args()
+
+    set_log_level('ERROR')
+
+    print('hours  streams  legacy (s)  current (s)  speedup')
+    for hours in args.hours:
+        eegstream = [make_eeg_stream(hours, 'Muse-%04d' % i, i) for i in range(args.streams)]
+        legacy, legacy_time = timeit(legacy_to_mne_eeg, eegstream, 50)
+        current, current_time = timeit(to_mne_eeg, eegstream, 50)
+        for raw_legacy, raw_current in zip(legacy, current):
+            assert raw_legacy.ch_names == raw_current.ch_names
+            assert np.array_equal(raw_legacy.get_data(), raw_current.get_data())
+        print('%5.1f  %7d  %10.2f  %11.2f  %6.1fx' % (hours, args.streams, legacy_time, current_time, legacy_time / current_time))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+'''Benchmark suite of the import, conversion, export and live view stages.
+
+Synthetic Muse recordings are generated in a temporary directory and every stage is
+timed (wall and CPU time, best and median of the repetitions) and then run once more
+under tracemalloc to measure its peak memory. Results are written as JSON so runs of
+different commits can be compared.
+
+Usage:
+    python benchmarks/run_benchmarks.py --files 4 --minutes 10 --output results.json
+    python benchmarks/run_benchmarks.py --files 4 --minutes 10 --compare results.json
+'''
+import argparse
+import json
+import numpy as np
+import platform
+import subprocess
+import tracemalloc
+import warnings
+from mne import set_log_level
+from musestudio import create_bids_path, export_bids, import_bids, read_raw_xdf_dir, to_df, to_mne_eeg
+from musestudio.ring_buffer import RingBuffer
+from musestudio.view import build_figure
+from os import path
+from synthetic_xdf import write_dataset
+from tempfile import TemporaryDirectory
+from time import perf_counter, process_time
+
+def measure(function, repeat = 3):
+    '''Time a function and measure its peak memory.
+
+    Returns:
+        The result of the last run and a dictionary with the measures.
+    '''
+    wall, cpu = [], []
+    for run in range(repeat):
+        start_wall, start_cpu = perf_counter(), process_time()
+        result = function()
+        wall.append(perf_counter() - start_wall)
+        cpu.append(process_time() - start_cpu)
+
+    # Memory is measured in a separate run, tracemalloc slows the code down
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return result, {
+        'wall': wall,
+        'wall_min': min(wall),
+        'wall_median': float(np.median(wall)),
+        'cpu_median': float(np.median(cpu)),
+        'peak_bytes': peak
+    }
+
+def draw_tick(n_streams = 1, retention = 60, data_shown = 1400, max_points = 1000):
+    '''Simulate an update of the live view: snapshot of every buffer and figure serialization.'''
+    buffers = []
+    for index in range(n_streams):
+        buffer = RingBuffer(retention * 256, 5)
+        buffer.append(np.random.default_rng(index).standard_normal((retention * 256, 5)) * 50, 1000 + np.arange(retention * 256) / 256)
+        buffers.append(buffer)
+    channels = ['TP9', 'AF7', 'AF8', 'TP10']
+
+    def tick():
+        for buffer in buffers:
+            data, timestamps = buffer.latest(data_shown)
+            data, timestamps = data.copy(), timestamps.copy()
+            fig = build_figure(timestamps, [(channel, data[:, index]) for index, channel in enumerate(channels)], False, max_points)
+            # Dash sends the figure as JSON to the browser
+            fig.to_json()
+
+    return tick
+
+def git_commit():
+    '''Commit of the working tree, if it is a git repository.'''
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, cwd=path.dirname(path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    results = {}
+    with TemporaryDirectory(prefix='musestudio_bench_') as temporal_dir:
+        data_dir = path.join(temporal_dir, 'xdf')
+        write_dataset(data_dir, args.files, args.minutes, args.devices)
+
+        (eegstream, accstream, ppgstream, gyrstream, filenames), results['read_raw_xdf_dir'] = measure(lambda: read_raw_xdf_dir(data_dir, n_jobs=args.jobs), args.repeat)
+        mne_eeg, results['to_mne_eeg'] = measure(lambda: to_mne_eeg(eegstream, 50), args.repeat)
+        results['to_df'] = measure(lambda: to_df(mne_eeg, eegstream, accstream, ppgstream, gyrstream), args.repeat)[1]
+
+        setup = [{'subject': '%02d' % (index + 1), 'task': 'bench', 'root': path.join(temporal_dir, 'bids')} for index in range(len(mne_eeg))]
+        bids_paths = create_bids_path(setup)
+        results['export_bids'] = measure(lambda: export_bids(mne_eeg, bids_paths, overwrite=True), args.repeat)[1]
+        results['import_bids'] = measure(lambda: import_bids(setup), args.repeat)[1]
+
+        results['draw_tick'] = measure(draw_tick(len(eegstream)), args.repeat * 10)[1]
+
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'parameters': {'files': args.files, 'minutes': args.minutes, 'devices': args.devices, 'jobs': args.jobs, 'repeat': args.repeat},
+        'results': results
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=2, help='number of synthetic recordings')
+    parser.add_argument('--minutes', type=float, default=5, help='duration of every recording')
+    parser.add_argument('--devices', type=int, default=1, help='number of Muse devices in every recording')
+    parser.add_argument('--jobs', type=int, default=1, help='processes used by read_raw_xdf_dir')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of every stage')
+    parser.add_argument('--output', help='JSON file where the results are written')
+    parser.add_argument('--compare', help='JSON file with the results of a previous run')
+    args = parser.parse_args()
+
+    set_log_level('ERROR')
+    warnings.simplefilter('ignore')
+
+    report = run(args)
+
+    if args.output is not None:
+        with open(args.output, mode='w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+
+    previous = None
+    if args.compare is not None:
+        with open(args.compare, mode='r', encoding='utf-8') as f:
+            previous = json.load(f)['results']
+
+    print('stage              wall min (s)  wall median (s)  peak memory (MB)' + ('  change' if previous else ''))
+    for stage, measures in report['results'].items():
+        line = '%-17s  %12.3f  %15.3f  %16.1f' % (stage, measures['wall_min'], measures['wall_median'], measures['peak_bytes'] / 2 ** 20)
+        if previous and stage in previous:
+            line += '  %+5.0f%%' % (100 * (measures['wall_min'] / previous[stage]['wall_min'] - 1))
+        print(line)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+'''Generator of synthetic Muse recordings in XDF format.
+
+Every device publishes the streams of a Muse headset: EEG (TP9, AF7, AF8, TP10 and
+Right AUX at 256 Hz), accelerometer and gyroscope (52 Hz) and PPG (64 Hz), written
+in small chunks as LSL delivers them, so the files are read like real recordings.
+
+Usage:
+    python benchmarks/synthetic_xdf.py output_dir --files 4 --minutes 10 --devices 2
+'''
+import argparse
+import numpy as np
+from musestudio.recorder import XdfWriter
+from os import makedirs, path
+
+# Type, channel labels, sampling frequency and samples per chunk of the Muse streams
+MUSE_STREAMS = [
+    ('EEG', ['TP9', 'AF7', 'AF8', 'TP10', 'Right AUX'], 256, 12),
+    ('Accelerometer', ['X', 'Y', 'Z'], 52, 3),
+    ('Gyroscope', ['X', 'Y', 'Z'], 52, 3),
+    ('PPG', ['PPG1', 'PPG2', 'PPG3'], 64, 6)
+]
+
+def stream_header(name, stream_type, labels, sfreq, source_id):
+    '''XML description of a stream, as published by Muse LSL drivers.'''
+    channels = ''.join('<channel><label>' + label + '</label></channel>' for label in labels)
+    return (
+        '<?xml version="1.0"?><info>'
+        + '<name>' + name + '</name><type>' + stream_type + '</type>'
+        + '<channel_count>' + str(len(labels)) + '</channel_count>'
+        + '<nominal_srate>' + str(sfreq) + '</nominal_srate>'
+        + '<channel_format>float32</channel_format>'
+        + '<source_id>' + source_id + '</source_id>'
+        + '<desc><channels>' + channels + '</channels></desc></info>'
+    )
+
+def write_recording(filename, minutes = 1, n_devices = 1, seed = 0):
+    '''Write a synthetic recording with the streams of n_devices Muse headsets.
+
+    Returns:
+        Number of samples written.
+    '''
+    rng = np.random.default_rng(seed)
+    writer = XdfWriter(filename)
+    streams = []
+    for device in range(n_devices):
+        name = 'Muse-%04X' % (seed * 256 + device)
+        for stream_type, labels, sfreq, chunk_size in MUSE_STREAMS:
+            stream_id = len(streams)
+            writer.add_stream(stream_id, stream_header(name, stream_type, labels, sfreq, name + '-' + stream_type))
+            n_samples = int(minutes * 60 * sfreq)
+            # Devices start at slightly different times, as real headsets do
+            timestamps = 1000 + device * 0.01 + np.arange(n_samples) / sfreq
+            samples = (rng.standard_normal((n_samples, len(labels))) * 50 + 800).astype(np.float32)
+            streams.append((stream_id, samples, timestamps, chunk_size))
+            # Clocks of the devices and the recorder are the same
+            writer.write_clock_offset(stream_id, timestamps[0], 0.0)
+
+    # Chunks of every stream are interleaved in time order, like LabRecorder writes them
+    chunks = sorted(
+        (timestamps[start], stream_id, start, chunk_size)
+        for stream_id, samples, timestamps, chunk_size in streams
+        for start in range(0, len(timestamps), chunk_size)
+    )
+    for time, stream_id, start, chunk_size in chunks:
+        stream_id, samples, timestamps, chunk_size = streams[stream_id]
+        writer.write_samples(stream_id, samples[start:start + chunk_size], timestamps[start:start + chunk_size])
+    for stream_id, samples, timestamps, chunk_size in streams:
+        writer.write_clock_offset(stream_id, timestamps[-1], 0.0)
+    writer.close()
+
+    return sum(len(timestamps) for stream_id, samples, timestamps, chunk_size in streams)
+
+def write_dataset(dirname, n_files = 1, minutes = 1, n_devices = 1):
+    '''Write n_files synthetic recordings in a directory. Returns their full paths.'''
+    makedirs(dirname, exist_ok=True)
+    filenames = []
+    for index in range(n_files):
+        filename = path.join(dirname, 'recording_%03d.xdf' % index)
+        write_recording(filename, minutes, n_devices, seed=index)
+        filenames.append(filename)
+    return filenames
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dirname', help='directory where the recordings are written')
+    parser.add_argument('--files', type=int, default=1, help='number of recordings')
+    parser.add_argument('--minutes', type=float, default=1, help='duration of every recording')
+    parser.add_argument('--devices', type=int, default=1, help='number of Muse devices in every recording')
+    args = parser.parse_args()
+
+    for filename in write_dataset(args.dirname, args.files, args.minutes, args.devices):
+        print(filename)
+
+if __name__ == '__main__':
+    main()
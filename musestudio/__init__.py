@@ -1,5 +1,44 @@
-from .convert_raw import to_df, to_mne_eeg
-from .export_bids_files import create_bids_path, export_bids
-from .import_bids_files import import_bids
-from .import_raw_files import read_raw_xdf, read_raw_xdf_dir
-from .view import search_streams, start_streaming
+from importlib import import_module
+
+# Submodule of every public function. Submodules are imported the first time one of
+# their functions is used, so reading XDF files does not load MNE, the live view
+# (dash, plotly) or LSL, and a missing liblsl only affects streaming.
+SUBMODULES = {
+    'to_df': 'convert_raw',
+    'to_long_df': 'convert_raw',
+    'to_mne_eeg': 'convert_raw',
+    'iter_windows': 'epoching',
+    'to_windows': 'epoching',
+    'create_bids_path': 'export_bids_files',
+    'export_bids': 'export_bids_files',
+    'export_parquet': 'export_parquet_files',
+    'import_bids': 'import_bids_files',
+    'index_bids': 'import_bids_files',
+    'load_bids': 'import_bids_files',
+    'query_bids': 'import_bids_files',
+    'add_handler': 'instrumentation',
+    'remove_handler': 'instrumentation',
+    'set_verbose': 'instrumentation',
+    'iter_raw_xdf': 'import_raw_files',
+    'iter_raw_xdf_chunks': 'import_raw_files',
+    'iter_raw_xdf_dir': 'import_raw_files',
+    'read_raw_xdf': 'import_raw_files',
+    'read_raw_xdf_dir': 'import_raw_files',
+    'record_streams': 'recorder',
+    'replay_xdf': 'replay',
+    'search_streams': 'view',
+    'start_streaming': 'view'
+}
+
+__all__ = list(SUBMODULES)
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        value = getattr(import_module('.' + SUBMODULES[name], __name__), name)
+        # Later uses do not go through __getattr__
+        globals()[name] = value
+        return value
+    raise AttributeError('module ' + repr(__name__) + ' has no attribute ' + repr(name))
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,82 @@
+import numpy as np
+from threading import Event, Lock, Thread
+
+class StreamReader(Thread):
+    '''Thread that continuously drains an LSL inlet into a ring buffer.
+
+    Acquisition runs at a steady rate whatever the state of the user interface, so
+    samples are neither delayed by slow renders nor dropped while the view is paused.
+    Readers of the buffer take a snapshot under the same lock used for writing.
+
+    Args:
+        inlet : pylsl.StreamInlet
+            LSL stream to read.
+        buffer : RingBuffer
+            Buffer where samples are stored.
+        timeout : float
+            Maximum time in seconds waiting for new samples in every read.
+        max_samples : int
+            Maximum number of samples read at once.
+        recorder : StreamRecorder
+            Recorder where every chunk is also written to disk. Not recorded if not specified.
+        stream_id : int
+            Identifier of the stream in the recorder.
+        processor : StreamProcessor
+            Filters applied to the samples before they are stored in the buffer. The
+            recorder receives the raw samples. Stored as acquired if not specified.
+    '''
+    def __init__(self, inlet, buffer, timeout = 0.05, max_samples = 4096, recorder = None, stream_id = 0, processor = None):
+        super().__init__(daemon=True, name='musestudio-reader-' + inlet.info().source_id())
+        self.inlet = inlet
+        self.buffer = buffer
+        self.timeout = timeout
+        self.max_samples = max_samples
+        self.recorder = recorder
+        self.stream_id = stream_id
+        self.processor = processor
+        self.lock = Lock()
+        self.stop_event = Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            samples, timestamps = self.inlet.pull_chunk(timeout=self.timeout, max_samples=self.max_samples)
+            if len(timestamps) > 0:
+                samples, timestamps = np.asarray(samples, dtype=np.float64), np.asarray(timestamps, dtype=np.float64)
+                self.add_chunk(samples, timestamps)
+                # Written outside the lock, so the view never waits for the disk
+                if self.recorder is not None:
+                    self.recorder.add_chunk(self.stream_id, samples, timestamps)
+
+    def add_chunk(self, samples, timestamps):
+        '''Store a chunk of samples in the buffer.'''
+        with self.lock:
+            if self.processor is not None:
+                samples = self.processor.process(samples)
+            self.buffer.append(samples, timestamps)
+
+    def snapshot(self, n_samples):
+        '''Get a copy of the latest samples and timestamps of the buffer.'''
+        with self.lock:
+            data, timestamps = self.buffer.latest(n_samples)
+            return data.copy(), timestamps.copy()
+
+    def read_since(self, count):
+        '''Get a copy of the samples appended after the first count samples of the stream.
+
+        Returns:
+            The samples, their timestamps and the total number of samples appended so far.
+        '''
+        with self.lock:
+            data, timestamps = self.buffer.latest(self.buffer.count - count)
+            return data.copy(), timestamps.copy(), self.buffer.count
+
+    def quality(self):
+        '''Get the range of every channel over the latest samples, as computed by the processor.'''
+        with self.lock:
+            return self.processor.quality.ranges()
+
+    def stop(self):
+        '''Stop reading and wait for the thread to finish.'''
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
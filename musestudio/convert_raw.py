@@ -1,8 +1,20 @@
 import numpy as np
 import pandas as pd
-from datetime import datetime
+from dateutil.tz import tzlocal
+from .instrumentation import Stage, report
 from mne import channels, create_info, io, Annotations
 
+# Stream columns placed under the montage channels (TP9, AF7, AF8, TP10, the stream order).
+# As in the original per-channel reordering, this shifts the data by one channel: TP9 holds
+# the AF7 samples, AF7 holds AF8, AF8 holds TP10 and TP10 holds TP9.
+EEG_CHANNEL_ORDER = [1, 2, 3, 0]
+
+EEG_COLUMNS = ['AF7', 'AF8', 'TP9', 'TP10']
+ACC_COLUMNS = ['X_acc', 'Y_acc', 'Z_acc']
+GYR_COLUMNS = ['X_gyr', 'Y_gyr', 'Z_gyr']
+PPG_COLUMNS = ['1_ppg', '2_ppg', '3_ppg']
+ALIGN_METHODS = ['previous', 'nearest', 'linear']
+
 def to_mne_eeg(eegstream = None, line_freq = None,  filenames = None, nasion = None, lpa = None, rpa = None):
     '''Convert recordings to MNE format.
 
@@ -49,23 +61,28 @@ def to_mne_eeg(eegstream = None, line_freq = None,  filenames = None, nasion = N
     # Define sensor coordinates
     sensor_coord = [[-0.0856192, -0.0465147, -0.0457070], [-0.0548397, 0.0685722, -0.0105900], [0.0557433, 0.0696568, -0.0107550], [0.0861618, -0.0470353, -0.0458690]]
     
+    # Get channels position. The montage is the same for every stream.
+    dig_montage = channels.make_dig_montage(ch_pos=dict(zip(ch_names, sensor_coord)), nasion=nasion if nasion is not None else None, lpa=lpa if lpa is not None else None, rpa=rpa if rpa is not None else None, coord_frame='head')
+    # Raw info for processing, created once per sampling rate. RawArray keeps its own copy.
+    infos = {}
+    
     for index, stream in enumerate(eegstream):
-        # Get channels position
-        dig_montage = channels.make_dig_montage(ch_pos=dict(zip(ch_names, sensor_coord)), nasion=nasion if nasion is not None else None, lpa=lpa if lpa is not None else None, rpa=rpa if rpa is not None else None, coord_frame='head')
-        # Create raw info for processing
-        info = create_info(ch_names=dig_montage.ch_names, sfreq=float(stream['info']['nominal_srate'][0]), ch_types='eeg')
-        # Add channels position to info
-        info.set_montage(dig_montage)
-        # Convert data from microvolts to volts
-        conv_data = stream["time_series"] * 1e-6
-        # Reorder channels
-        ord_data = [[sublist[1][item] for item in [1, 2, 3, 0]] for sublist in enumerate(conv_data)]
-        # Create raw data for mne
-        raw = io.RawArray(np.array(ord_data).T, info)
+        sfreq = float(stream['info']['nominal_srate'][0])
+        if sfreq not in infos:
+            info = create_info(ch_names=dig_montage.ch_names, sfreq=sfreq, ch_types='eeg')
+            # Add channels position to info
+            info.set_montage(dig_montage)
+            infos[sfreq] = info
         # Get the information of each stream
         stream_info = stream['info']['name'][0][:9] + ' ' + (filenames[index] if filenames is not None else '')
+        with Stage('to_mne_eeg', stream_info, samples=len(stream['time_series'])) as stage:
+            # Reorder channels as described in EEG_CHANNEL_ORDER and convert data from microvolts to volts, as a (channels, samples) array
+            data = (np.asarray(stream['time_series'])[:, EEG_CHANNEL_ORDER] * 1e-6).T
+            # Create raw data for mne
+            raw = io.RawArray(data, infos[sfreq])
+            stage.bytes = data.nbytes
         # Print the information of each stream
-        print('\nInfo: ' + str(index) + ' ' + stream_info + '\n')
+        report('\nInfo: ' + str(index) + ' ' + stream_info + '\n')
         # Add the powerline frequency of each stream
         raw.info['line_freq'] = line_freq
         # Create annotation to store the name of the device and the filenames
@@ -77,9 +94,12 @@ def to_mne_eeg(eegstream = None, line_freq = None,  filenames = None, nasion = N
     
     return raweeg
 
-def to_df(mne_eeg = None, eegstream = None, accstream = None, ppgstream = None, gyrstream = None):
+def to_df(mne_eeg = None, eegstream = None, accstream = None, ppgstream = None, gyrstream = None, method = 'previous', tolerance = None):
     '''Convert recordings to Pandas DataFrame.
 
+    Accelerometer, gyroscope and PPG samples are aligned to the EEG samples using the
+    LSL timestamps of every stream.
+
     Args:
         mne_eeg : array
             EEG streams as MNE RawArray instances.
@@ -91,15 +111,24 @@ def to_df(mne_eeg = None, eegstream = None, accstream = None, ppgstream = None,
             Gyroscope streams.
         ppgstream : array
             PPG streams.
+        method : string
+            How auxiliary samples are matched to EEG samples: 'previous' (last sample received),
+            'nearest' (closest sample in time) or 'linear' (linear interpolation).
+        tolerance : float
+            Maximum distance in seconds between an EEG sample and the auxiliary sample used.
+            Values further away are left empty (NaN). No limit if not specified.
     Returns:
         An array containing the dataframes for the streams specified.
     Raises:
-        ValueError: if mne_eeg or eegstream are not specified.
+        ValueError: if mne_eeg or eegstream are not specified, or method is not valid.
     See also:
         to_mne_eeg
     '''
     if mne_eeg is None or eegstream is None:
         raise(ValueError('Enter EEG recordings in MNE and array formats.'))
+
+    if method not in ALIGN_METHODS:
+        raise(ValueError('Alignment method must be one of: ' + ', '.join(ALIGN_METHODS) + '.'))
     
     mne_eeg = [mne_eeg] if not isinstance(mne_eeg, list) else mne_eeg
     eegstream = [eegstream] if not isinstance(eegstream, list) else eegstream
@@ -108,39 +137,184 @@ def to_df(mne_eeg = None, eegstream = None, accstream = None, ppgstream = None,
     ppgstream = [ppgstream] if not isinstance(ppgstream, list) and ppgstream is not None else ppgstream
 
     df_array = []
-    # Iterate through each stream, convert them into dataframes and merge them
+    # Iterate through each stream, convert them into dataframes and align the auxiliary streams
     for index, stream in enumerate(mne_eeg):
-        df = stream \
-            .to_data_frame(scalings=dict(eeg=1)) \
-            .reset_index() \
-            .join(pd.Series(eegstream[index]['time_stamps']).rename('timestamp')) \
-            .drop('time', axis=1)
-        df['timestamp'] = df['timestamp'].apply(lambda x: datetime.fromtimestamp(x))
-        df = df[['timestamp', 'AF7', 'AF8', 'TP9', 'TP10']]
-        df.index.rename('index', inplace=True)
-
-        if accstream is not None:
-            df_acc = pd.DataFrame(accstream[index]['time_series'], columns=['X_acc', 'Y_acc', 'Z_acc'])
-            # Multiply the indexes to match the incoming eeg data rate from the device (256/50 = 5.12)
-            df_acc.index = df_acc.index * 5
-            df_acc.index.rename('index', inplace=True)
-            df = pd.merge_asof(df, df_acc, on='index', by='index')
-
-        if gyrstream is not None:
-            df_gyr = pd.DataFrame(gyrstream[index]['time_series'], columns=['X_gyr', 'Y_gyr', 'Z_gyr'])
-            df_gyr.index = df_gyr.index * 5
-            df_gyr.index.rename('index', inplace=True)
-            df = pd.merge_asof(df, df_gyr, on='index', by='index')
-
-        if ppgstream is not None:
-            df_ppg = pd.DataFrame(ppgstream[index]['time_series'], columns=['1_ppg', '2_ppg', '3_ppg'])
-            df_ppg.index = df_ppg.index * 4
-            df_ppg.index.rename('index', inplace=True)
-            df = pd.merge_asof(df, df_ppg, on='index', by='index')
-        
-        if accstream is not None or gyrstream is not None or ppgstream is not None:
-            df.drop('index', axis=1, inplace=True)
-        #df.interpolate(method='linear', limit_direction='forward', axis=0, inplace=True)
+        with Stage('to_df', ' '.join(stream.annotations.description), samples=stream.n_times) as stage:
+            df = stream.to_data_frame(scalings=dict(eeg=1))
+            eeg_times = np.asarray(eegstream[index]['time_stamps'])[:len(df)]
+            df['timestamp'] = to_local_datetime(eeg_times)
+            df = df[['timestamp'] + EEG_COLUMNS]
+            df.index.rename('index', inplace=True)
+
+            for auxstream, columns in [(accstream, ACC_COLUMNS), (gyrstream, GYR_COLUMNS), (ppgstream, PPG_COLUMNS)]:
+                if auxstream is not None:
+                    aligned = align_stream(eeg_times, auxstream[index]['time_stamps'], auxstream[index]['time_series'], method, tolerance, len(columns))
+                    for position, column in enumerate(columns):
+                        df[column] = aligned[:, position]
+            if stage.active:
+                stage.bytes = int(df.memory_usage(index=False).sum())
         
         df_array.append(df)
     return df_array
+
+def to_long_df(mne_eeg = None, eegstream = None, accstream = None, ppgstream = None, gyrstream = None, filenames = None, method = 'previous', tolerance = None, timestamp_format = 'int64'):
+    '''Convert many recordings to a single compact Pandas DataFrame in long format.
+
+    The samples of every recording are stacked in one frame. Recording, device and file
+    identifiers are categorical columns and signals are float32, so a whole cohort uses
+    little more memory than the signals themselves. The frame is filled from preallocated
+    arrays, without merging the recordings one by one.
+
+    Args:
+        mne_eeg : array
+            EEG streams as MNE RawArray instances.
+        eegstream : array
+            EEG streams. Used for timestamps.
+        accstream : array
+            Accelerometer streams.
+        ppgstream : array
+            PPG streams.
+        gyrstream : array
+            Gyroscope streams.
+        filenames : array
+            Filenames of the recordings, as returned by read_raw_xdf_dir.
+        method : string
+            How auxiliary samples are matched to EEG samples: 'previous', 'nearest' or 'linear'.
+        tolerance : float
+            Maximum distance in seconds between an EEG sample and the auxiliary sample used.
+        timestamp_format : string
+            'int64' for LSL timestamps in nanoseconds, or 'datetime64' for UTC datetimes.
+    Returns:
+        A dataframe with the columns recording, device, file, timestamp and one column per signal.
+    Raises:
+        ValueError: if mne_eeg or eegstream are not specified, or method or timestamp_format are not valid.
+    See also:
+        to_df
+    '''
+    if mne_eeg is None or eegstream is None:
+        raise(ValueError('Enter EEG recordings in MNE and array formats.'))
+
+    if method not in ALIGN_METHODS:
+        raise(ValueError('Alignment method must be one of: ' + ', '.join(ALIGN_METHODS) + '.'))
+
+    if timestamp_format not in ['int64', 'datetime64']:
+        raise(ValueError('Timestamp format must be int64 or datetime64.'))
+
+    mne_eeg = [mne_eeg] if not isinstance(mne_eeg, list) else mne_eeg
+    eegstream = [eegstream] if not isinstance(eegstream, list) else eegstream
+    accstream = [accstream] if not isinstance(accstream, list) and accstream is not None else accstream
+    gyrstream = [gyrstream] if not isinstance(gyrstream, list) and gyrstream is not None else gyrstream
+    ppgstream = [ppgstream] if not isinstance(ppgstream, list) and ppgstream is not None else ppgstream
+    filenames = [filenames] if not isinstance(filenames, list) and filenames is not None else filenames
+
+    auxiliary = [(auxstream, columns) for auxstream, columns in [(accstream, ACC_COLUMNS), (gyrstream, GYR_COLUMNS), (ppgstream, PPG_COLUMNS)] if auxstream is not None]
+    columns = EEG_COLUMNS + [column for _, aux_columns in auxiliary for column in aux_columns]
+
+    n_samples = [min(raw.n_times, len(eegstream[index]['time_stamps'])) for index, raw in enumerate(mne_eeg)]
+    total = sum(n_samples)
+
+    with Stage('to_long_df', samples=total) as stage:
+        # Preallocate the arrays of the whole frame
+        recording_codes = np.empty(total, dtype=np.int32)
+        timestamps = np.empty(total, dtype=np.int64)
+        signals = np.empty((total, len(columns)), dtype=np.float32)
+
+        recordings, devices, files = [], [], []
+        start = 0
+        for index, raw in enumerate(mne_eeg):
+            stop = start + n_samples[index]
+            eeg_times = np.asarray(eegstream[index]['time_stamps'])[:n_samples[index]]
+
+            recording_codes[start:stop] = index
+            timestamps[start:stop] = np.round(eeg_times * 1e9).astype(np.int64)
+            signals[start:stop, :len(EEG_COLUMNS)] = raw.get_data(picks=EEG_COLUMNS, stop=n_samples[index]).T
+
+            position = len(EEG_COLUMNS)
+            for auxstream, aux_columns in auxiliary:
+                signals[start:stop, position:position + len(aux_columns)] = align_stream(eeg_times, auxstream[index]['time_stamps'], auxstream[index]['time_series'], method, tolerance, len(aux_columns))
+                position += len(aux_columns)
+
+            devices.append(eegstream[index]['info']['name'][0][:9])
+            files.append(filenames[index] if filenames is not None else '')
+            recordings.append((str(index) + ' ' + devices[-1] + ' ' + files[-1]).strip())
+            start = stop
+
+        # Signals are kept in a single float32 block. Identifiers are stored once per recording as categories.
+        df = pd.DataFrame(signals, columns=columns, copy=False)
+        device_categories, device_codes = np.unique(devices, return_inverse=True)
+        file_categories, file_codes = np.unique(files, return_inverse=True)
+        df.insert(0, 'recording', pd.Categorical.from_codes(recording_codes, categories=recordings))
+        df.insert(1, 'device', pd.Categorical.from_codes(device_codes[recording_codes], categories=device_categories))
+        df.insert(2, 'file', pd.Categorical.from_codes(file_codes[recording_codes], categories=file_categories))
+        df.insert(3, 'timestamp', timestamps if timestamp_format == 'int64' else timestamps.view('datetime64[ns]'))
+
+        stage.bytes = signals.nbytes
+
+    return df
+
+def to_local_datetime(timestamps):
+    '''Convert LSL timestamps in seconds to naive local datetimes in a single vectorized cast.'''
+    return pd.to_datetime(np.asarray(timestamps), unit='s', utc=True).tz_convert(tzlocal()).tz_localize(None)
+
+def align_stream(times, aux_times, aux_values, method = 'previous', tolerance = None, n_channels = None):
+    '''Align the samples of a stream to a timeline.
+
+    Args:
+        times : array, shape(n_times,)
+            Timestamps of the target timeline, in seconds.
+        aux_times : array, shape(n_samples,)
+            Timestamps of the stream to align, in seconds.
+        aux_values : array, shape(n_samples, n_channels)
+            Samples of the stream to align.
+        method : string
+            'previous', 'nearest' or 'linear'.
+        tolerance : float
+            Maximum distance in seconds to the sample used. No limit if not specified.
+        n_channels : int
+            Number of channels of the stream. Taken from aux_values if not specified.
+    Returns:
+        Array of shape (n_times, n_channels) with NaN where no sample is available.
+    '''
+    times = np.asarray(times, dtype=np.float64)
+    aux_times = np.asarray(aux_times, dtype=np.float64)
+    aux_values = np.asarray(aux_values, dtype=np.float64)
+
+    # Streams without samples, e.g. cropped out of the time range, give an empty block
+    if len(aux_times) == 0 or len(times) == 0:
+        if n_channels is None:
+            n_channels = aux_values.shape[1] if aux_values.ndim > 1 else 1
+        return np.full((len(times), n_channels), np.nan)
+
+    aux_values = aux_values.reshape(len(aux_times), -1)
+    aligned = np.full((len(times), aux_values.shape[1]), np.nan)
+
+    if np.any(np.diff(aux_times) < 0):
+        order = np.argsort(aux_times, kind='stable')
+        aux_times, aux_values = aux_times[order], aux_values[order]
+
+    # Index of the last auxiliary sample at or before every timestamp
+    previous = np.searchsorted(aux_times, times, side='right') - 1
+
+    if method == 'linear':
+        for channel in range(aux_values.shape[1]):
+            aligned[:, channel] = np.interp(times, aux_times, aux_values[:, channel], left=np.nan, right=np.nan)
+        if tolerance is not None:
+            following = np.clip(previous + 1, 0, len(aux_times) - 1)
+            distance = np.minimum(np.abs(times - aux_times[np.clip(previous, 0, None)]), np.abs(aux_times[following] - times))
+            aligned[distance > tolerance] = np.nan
+        return aligned
+
+    if method == 'nearest':
+        before = np.clip(previous, 0, None)
+        after = np.clip(previous + 1, 0, len(aux_times) - 1)
+        selected = np.where(np.abs(aux_times[after] - times) < np.abs(times - aux_times[before]), after, before)
+        valid = np.ones(len(times), dtype=bool)
+    else:
+        selected = np.clip(previous, 0, None)
+        valid = previous >= 0
+
+    if tolerance is not None:
+        valid &= np.abs(times - aux_times[selected]) <= tolerance
+
+    aligned[valid] = aux_values[selected[valid]]
+    return aligned
@@ -0,0 +1,106 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+def to_windows(recording = None, duration = None, overlap = 0, label = None):
+    '''Split a recording into fixed-length overlapping windows without copying its data.
+
+    Windows are read-only views of the samples of the recording, whatever the overlap.
+    Use np.array(windows) or windows.copy() to get an independent array.
+
+    Args:
+        recording : dict or mne.io.Raw
+            A stream as returned by read_raw_xdf, or a recording with its data loaded,
+            e.g. as returned by to_mne_eeg.
+        duration : float
+            Duration of every window in seconds.
+        overlap : float
+            Seconds shared by consecutive windows. Must be lower than duration.
+        label : string
+            Label of the windows. Defaults to the device of streams and the annotations of MNE recordings.
+    Returns:
+        Three arrays: the windows with shape (n_windows, n_channels, n_samples), the start time of
+        every window (LSL timestamps for streams, seconds from the start for MNE recordings) and
+        the label of every window.
+    Raises:
+        ValueError: if no recording or duration is specified, or overlap is not lower than duration.
+    See also:
+        iter_windows
+        to_mne_eeg
+    '''
+    if recording is None or duration is None:
+        raise(ValueError('Enter a recording and the duration of the windows.'))
+
+    if not 0 <= overlap < duration:
+        raise(ValueError('overlap must be positive and lower than duration.'))
+
+    if isinstance(recording, dict):
+        sfreq = float(recording['info']['nominal_srate'][0])
+        # Streams are stored as (samples, channels)
+        data = np.asarray(recording['time_series']).T
+        times = np.asarray(recording['time_stamps'])
+        label = recording['info']['name'][0][:9] if label is None else label
+    else:
+        sfreq = recording.info['sfreq']
+        if not recording.preload:
+            recording.load_data()
+        # The data array of the recording, get_data would return a copy
+        data = recording._data
+        times = recording.times
+        label = ' '.join(recording.annotations.description) if label is None else label
+
+    n_samples = int(round(duration * sfreq))
+    step = n_samples - int(round(overlap * sfreq))
+    if n_samples < 1 or step < 1:
+        raise(ValueError('Windows and their step must be at least one sample long at ' + str(sfreq) + ' Hz.'))
+
+    if data.shape[1] < n_samples:
+        windows = np.empty((0, data.shape[0], n_samples), dtype=data.dtype)
+    else:
+        # (channels, windows, samples) view, with windows moved to the first axis
+        windows = sliding_window_view(data, n_samples, axis=1)[:, ::step].transpose(1, 0, 2)
+
+    return windows, times[:len(windows) * step:step], np.broadcast_to(np.array(label), (len(windows),))
+
+def iter_windows(recordings = None, duration = None, overlap = 0, batch_size = 256, labels = None):
+    '''Split many recordings into fixed-length overlapping windows, yielding them in batches.
+
+    Every batch holds windows of a single recording, so batches are views of the
+    recordings and no data is copied. The last batch of a recording may be smaller.
+
+    Args:
+        recordings : array
+            Streams as returned by read_raw_xdf, or recordings as returned by to_mne_eeg.
+        duration : float
+            Duration of every window in seconds.
+        overlap : float
+            Seconds shared by consecutive windows. Must be lower than duration.
+        batch_size : int
+            Maximum number of windows per batch.
+        labels : array
+            Label of every recording. Defaults to the labels of to_windows.
+    Yields:
+        Three arrays, with the layout returned by to_windows, with at most batch_size windows.
+    Raises:
+        ValueError: if no recordings or duration are specified, overlap is not lower than
+            duration or batch_size is lower than 1.
+    See also:
+        to_windows
+    '''
+    if recordings is None or duration is None:
+        raise(ValueError('Enter the recordings to split into windows and the duration of the windows.'))
+
+    if not 0 <= overlap < duration:
+        raise(ValueError('overlap must be positive and lower than duration.'))
+
+    if batch_size < 1:
+        raise(ValueError('batch_size must be at least 1.'))
+
+    recordings = [recordings] if not isinstance(recordings, list) else recordings
+
+    return iter_batches(recordings, duration, overlap, batch_size, labels)
+
+def iter_batches(recordings, duration, overlap, batch_size, labels):
+    for index, recording in enumerate(recordings):
+        windows, times, window_labels = to_windows(recording, duration, overlap, labels[index] if labels is not None else None)
+        for start in range(0, len(windows), batch_size):
+            yield windows[start:start + batch_size], times[start:start + batch_size], window_labels[start:start + batch_size]
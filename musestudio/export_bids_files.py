@@ -1,11 +1,21 @@
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from csv import DictReader, DictWriter
+from hashlib import sha256
+from inspect import signature
+from .instrumentation import Stage, emit, report
 from mne import io
 from mne_bids import BIDSPath, write_raw_bids
-from os import remove, path
+from os import O_CREAT, O_EXCL, O_WRONLY, close, cpu_count, open as os_open, path, remove, replace
 from platform import system
-from tempfile import gettempdir
+from tempfile import TemporaryDirectory
+from time import sleep, time
 from warnings import warn
 
+WRITE_RAW_BIDS_PARAMS = signature(write_raw_bids).parameters
+
 def create_bids_path(setup = None):
     '''Create paths for BIDS.
 
@@ -63,7 +73,7 @@ def create_bids_path(setup = None):
     
     return bids_paths
 
-def export_bids(raweeg = None, bids_paths = None, participants = None, overwrite = False, verbose=False):
+def export_bids(raweeg = None, bids_paths = None, participants = None, overwrite = False, verbose=False, n_jobs = 1, incremental = False):
     '''Export recordings in BIDS format.
 
     Args:
@@ -77,6 +87,13 @@ def export_bids(raweeg = None, bids_paths = None, participants = None, overwrite
             Overwrite existing BIDS recordings.
         verbose : bool
             Show process while exporting.
+        n_jobs : int
+            Number of processes used to write the recordings. Use -1 for all CPUs.
+            Recordings of the same subject and session are written by the same process.
+        incremental : bool
+            Only write recordings that are new or changed since the previous incremental export.
+            A content hash of every recording and its BIDS path is kept in .musestudio_export.json
+            in the root of the dataset. Changed recordings are overwritten.
     Raises:
         ValueError: if no stream is specified in raweeg, or raweeg and bids_paths do not have the same lenght.
     See also:
@@ -87,73 +104,185 @@ def export_bids(raweeg = None, bids_paths = None, participants = None, overwrite
 
     raweeg = [raweeg] if not isinstance(raweeg, list) else raweeg
     bids_paths = [bids_paths] if not isinstance(bids_paths, list) else bids_paths
-    participants = [participants] if not isinstance(participants, list) else participants
+    participants = [participants] if not isinstance(participants, list) and participants is not None else participants
 
     if len(raweeg) != len(bids_paths):
         raise ValueError('BIDS path and eeg arrays must have the same length.')
 
-    # Create BIDS 
-    for index, recording in enumerate(raweeg):
-        if system() == 'Windows':
-            temporal_file_path = gettempdir() + '\\dummy_raw.fif'
-        else:
-            temporal_file_path = gettempdir() + '/dummy_raw.fif'
-        
-        if path.exists(temporal_file_path):
-            remove(temporal_file_path)
+    if n_jobs is None or n_jobs == 0:
+        raise ValueError('n_jobs must be a positive integer or -1.')
 
-        # Temporal file storing because of package requirements
-        recording.save(temporal_file_path)
-        file_rec = io.Raw(fname=temporal_file_path)
-
-        # Create BIDS structure with EEG data
-        write_raw_bids(
-            raw=file_rec,
-            bids_path=bids_paths[index],
-            events_data=None,
-            event_id=None,
-            anonymize=None,
-            overwrite=overwrite,
-            verbose=verbose
-        )
-        
-        remove(temporal_file_path)
-        print('Exported recording: ', recording.annotations.description)
-
-    # Fill participants info file
-    if participants != 'None':
-        for subject in participants:
-            root_folder = r'%s' % subject['root']
-            if system() == 'Windows':
-                if root_folder[-1] == '\\':
-                    root_folder = root_folder + 'participants.tsv'
-                else:
-                    root_folder = root_folder + '\\participants.tsv'
+    # Skip the recordings exported before without changes
+    pending = list(range(len(raweeg)))
+    if incremental:
+        hashes = [recording_hash(recording, bids_paths[index]) for index, recording in enumerate(raweeg)]
+        manifests = {root: read_export_manifest(root) for root in set(str(bids_path.root) for bids_path in bids_paths)}
+        pending = []
+        for index, bids_path in enumerate(bids_paths):
+            if manifests[str(bids_path.root)].get(bids_path.basename) == hashes[index] and bids_path.fpath.exists():
+                report('Skipped unchanged recording: ', raweeg[index].annotations.description)
             else:
-                if root_folder[-1] == '/':
-                    root_folder = root_folder + 'participants.tsv'
-                else:
-                    root_folder = root_folder + '/participants.tsv'
-        
-        with open(root_folder, mode='r+', encoding='utf-8-sig') as tsvfile:
-            reader = DictReader(tsvfile, dialect='excel-tab')
-
-            data = []
-            for par in reader:
-                del par['weight']
-                del par['height']
-                for par2 in participants:
-                    if par['participant_id'] == 'sub-'+par2['participant_id']:
-                        par['age'] = par2['age']
-                        par['sex'] = par2['sex']
-                        par['hand'] = par2['hand']
-                        break
-                data.append(par)
-            
-            tsvfile.seek(0)
-            tsvfile.truncate()
-            
-            writer = DictWriter(tsvfile, dialect='excel-tab', fieldnames=['participant_id', 'age', 'sex', 'hand'])
+                pending.append(index)
+        overwrite = True
+
+    # Create BIDS 
+    if n_jobs == 1:
+        for index in pending:
+            with Stage('export_bids', bids_paths[index].basename, samples=raweeg[index].n_times):
+                write_recording(raweeg[index], bids_paths[index], overwrite, verbose)
+            report('Exported recording: ', raweeg[index].annotations.description)
+    else:
+        # Recordings sharing a scans.tsv are grouped so that only one process writes it
+        groups = {}
+        for index in pending:
+            bids_path = bids_paths[index]
+            groups.setdefault((str(bids_path.root), bids_path.subject, bids_path.session), []).append(index)
+
+        with ProcessPoolExecutor(max_workers=cpu_count() if n_jobs < 0 else n_jobs) as executor:
+            futures = [
+                executor.submit(write_recordings, [raweeg[index] for index in group], [bids_paths[index] for index in group], overwrite, verbose)
+                for group in groups.values()
+            ]
+            for group, future in zip(groups.values(), futures):
+                # Stages measured in the worker processes are reported here
+                for event in future.result():
+                    emit(event)
+                for index in group:
+                    report('Exported recording: ', raweeg[index].annotations.description)
+
+    # Record the hashes of the written recordings
+    if incremental and len(pending) > 0:
+        written = {}
+        for index in pending:
+            written.setdefault(str(bids_paths[index].root), {})[bids_paths[index].basename] = hashes[index]
+        for root_folder, root_hashes in written.items():
+            update_export_manifest(root_folder, root_hashes)
+
+    # Fill participants info file of every root once, after all the recordings are written
+    roots = {}
+    for bids_path in bids_paths:
+        roots.setdefault(str(bids_path.root), {'subjects': [], 'participants': {}})['subjects'].append('sub-' + bids_path.subject)
+    for subject in participants if participants is not None else []:
+        participant_id = subject['participant_id'] if 'participant_id' in subject else subject['subject']
+        roots.setdefault(str(subject['root']), {'subjects': [], 'participants': {}})['participants']['sub-' + str(participant_id)] = subject
+
+    for root_folder, root in roots.items():
+        if n_jobs != 1 or len(root['participants']) > 0:
+            update_participants(root_folder, root['subjects'], root['participants'])
+
+def update_participants(root_folder, subjects, participants):
+    '''Merge participants metadata into the participants.tsv file of a BIDS root.
+
+    Rows are indexed by participant_id, so every participant is found with a single lookup.
+    Subjects exported to the root that are missing from the file, e.g. because parallel
+    writers replaced the file at the same time, are added back. The file is locked while
+    it is updated.
+    '''
+    participants_file = path.join(root_folder, 'participants.tsv')
+    fieldnames = ['participant_id', 'age', 'sex', 'hand']
+
+    with file_lock(participants_file):
+        rows = {}
+        if path.exists(participants_file):
+            with open(participants_file, mode='r', encoding='utf-8-sig') as tsvfile:
+                for par in DictReader(tsvfile, dialect='excel-tab'):
+                    rows[par['participant_id']] = {field: par.get(field, 'n/a') for field in fieldnames}
+
+        for participant_id in subjects:
+            if participant_id not in rows:
+                rows[participant_id] = {'participant_id': participant_id, 'age': 'n/a', 'sex': 'n/a', 'hand': 'n/a'}
+
+        for participant_id, par2 in participants.items():
+            if participant_id in rows:
+                rows[participant_id]['age'] = par2['age']
+                rows[participant_id]['sex'] = par2['sex']
+                rows[participant_id]['hand'] = par2['hand']
+
+        with open(participants_file, mode='w', encoding='utf-8-sig', newline='') as tsvfile:
+            writer = DictWriter(tsvfile, dialect='excel-tab', fieldnames=fieldnames)
             writer.writeheader()
-            for row in data:
-                writer.writerow(row)
+            for participant_id in sorted(rows):
+                writer.writerow(rows[participant_id])
+
+def recording_hash(recording, bids_path):
+    '''Get a content hash of a recording, its metadata and its BIDS path.'''
+    content = sha256()
+    content.update(bids_path.basename.encode('utf-8'))
+    content.update(repr((recording.ch_names, recording.info['sfreq'], recording.info['line_freq'], list(recording.annotations.description))).encode('utf-8'))
+    content.update(memoryview(np.ascontiguousarray(recording.get_data())).cast('B'))
+    return content.hexdigest()
+
+def read_export_manifest(root_folder):
+    '''Read the hashes of the recordings exported to a BIDS root. Empty if there is no manifest.'''
+    manifest = path.join(root_folder, '.musestudio_export.json')
+    if not path.exists(manifest):
+        return {}
+    with open(manifest, mode='r', encoding='utf-8') as f:
+        return json.load(f)
+
+def update_export_manifest(root_folder, hashes):
+    '''Add the hashes of new recordings to the manifest of a BIDS root.'''
+    manifest = path.join(root_folder, '.musestudio_export.json')
+    with file_lock(manifest):
+        exported = read_export_manifest(root_folder)
+        exported.update(hashes)
+        with open(manifest + '.tmp', mode='w', encoding='utf-8') as f:
+            json.dump(exported, f, indent=1, sort_keys=True)
+        replace(manifest + '.tmp', manifest)
+
+@contextmanager
+def file_lock(filename, timeout = 60):
+    '''Lock a file across processes by creating a lock file next to it.'''
+    lock_file = filename + '.lock'
+    start = time()
+    while True:
+        try:
+            lock = os_open(lock_file, O_CREAT | O_EXCL | O_WRONLY)
+            break
+        except FileExistsError:
+            if time() - start > timeout:
+                raise RuntimeError('Could not lock ' + filename + '. Remove ' + lock_file + ' if no export is running.')
+            sleep(0.05)
+    try:
+        yield
+    finally:
+        close(lock)
+        remove(lock_file)
+
+def write_recordings(recordings, bids_paths, overwrite = False, verbose = False):
+    '''Write a group of recordings in BIDS format, one after another. Returns the measures of every recording.'''
+    events = []
+    for recording, bids_path in zip(recordings, bids_paths):
+        with Stage('export_bids', bids_path.basename, samples=recording.n_times, deferred=True) as stage:
+            write_recording(recording, bids_path, overwrite, verbose)
+        events.append(stage.event)
+    return events
+
+def write_recording(recording, bids_path, overwrite = False, verbose = False):
+    '''Write a single recording in BIDS format.
+
+    Recordings held in memory are written directly as BrainVision, the format used by
+    MNE-BIDS for EEG. Older MNE-BIDS versions only accept recordings read from disk, so
+    the recording is saved to a temporary FIF file unique to this call.
+    '''
+    options = dict(
+        bids_path=bids_path,
+        event_id=None,
+        anonymize=None,
+        overwrite=overwrite,
+        verbose=verbose
+    )
+    options['events' if 'events' in WRITE_RAW_BIDS_PARAMS else 'events_data'] = None
+
+    if 'allow_preload' in WRITE_RAW_BIDS_PARAMS:
+        write_raw_bids(raw=recording, allow_preload=True, format='BrainVision', **options)
+        return
+
+    # Temporal file storing because of package requirements
+    with TemporaryDirectory(prefix='musestudio_') as temporal_dir:
+        temporal_file_path = path.join(temporal_dir, 'raw.fif')
+        recording.save(temporal_file_path)
+        file_rec = io.read_raw_fif(temporal_file_path)
+        write_raw_bids(raw=file_rec, **options)
+        # Release the file before the temporary directory is removed
+        file_rec.close()
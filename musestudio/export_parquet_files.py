@@ -0,0 +1,109 @@
+from .convert_raw import to_long_df
+from os import makedirs, path
+
+def export_parquet(mne_eeg = None, eegstream = None, accstream = None, ppgstream = None, gyrstream = None, root = None, subjects = None, sessions = None, filenames = None, row_group_size = 65536, compression = 'zstd', method = 'previous', tolerance = None):
+    '''Export recordings to a partitioned Parquet dataset.
+
+    Every recording is converted and written on its own, so memory depends on the
+    largest recording and not on the number of recordings. Files are partitioned in
+    hive style (subject=.../session=.../device=...), so Arrow, pandas or Spark can
+    read only the partitions, columns and row groups a query needs.
+
+    Args:
+        mne_eeg : array
+            EEG streams as MNE RawArray instances.
+        eegstream : array
+            EEG streams. Used for timestamps.
+        accstream : array
+            Accelerometer streams.
+        ppgstream : array
+            PPG streams.
+        gyrstream : array
+            Gyroscope streams.
+        root : string
+            Directory of the Parquet dataset.
+        subjects : array
+            Subject of every recording. The subject partition is omitted if not specified.
+        sessions : array
+            Session of every recording. The session partition is omitted if not specified.
+        filenames : array
+            Filenames of the recordings, as returned by read_raw_xdf_dir. Used to name the Parquet files.
+        row_group_size : int
+            Maximum number of samples per row group.
+        compression : string
+            Parquet compression codec: 'zstd', 'snappy', 'gzip', 'brotli', 'lz4' or 'none'.
+        method : string
+            How auxiliary samples are matched to EEG samples: 'previous', 'nearest' or 'linear'.
+        tolerance : float
+            Maximum distance in seconds between an EEG sample and the auxiliary sample used.
+    Returns:
+        Array with the paths of the Parquet files written.
+    Raises:
+        ValueError: if mne_eeg, eegstream or root are not specified, or subjects or sessions do not have the same length as mne_eeg.
+        ImportError: if pyarrow is not installed.
+    See also:
+        to_long_df
+    '''
+    if mne_eeg is None or eegstream is None:
+        raise(ValueError('Enter EEG recordings in MNE and array formats.'))
+
+    if root is None:
+        raise(ValueError('Enter the root directory of the Parquet dataset.'))
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise(ImportError('Parquet export requires pyarrow. Install it with: pip install musestudio[parquet]'))
+
+    mne_eeg = [mne_eeg] if not isinstance(mne_eeg, list) else mne_eeg
+    eegstream = [eegstream] if not isinstance(eegstream, list) else eegstream
+    accstream = [accstream] if not isinstance(accstream, list) and accstream is not None else accstream
+    gyrstream = [gyrstream] if not isinstance(gyrstream, list) and gyrstream is not None else gyrstream
+    ppgstream = [ppgstream] if not isinstance(ppgstream, list) and ppgstream is not None else ppgstream
+    subjects = [subjects] if not isinstance(subjects, list) and subjects is not None else subjects
+    sessions = [sessions] if not isinstance(sessions, list) and sessions is not None else sessions
+    filenames = [filenames] if not isinstance(filenames, list) and filenames is not None else filenames
+
+    for partition in [subjects, sessions]:
+        if partition is not None and len(partition) != len(mne_eeg):
+            raise(ValueError('Subjects and sessions arrays must have the same length as the recordings.'))
+
+    written = []
+    for index, raw in enumerate(mne_eeg):
+        df = to_long_df(
+            mne_eeg=[raw],
+            eegstream=[eegstream[index]],
+            accstream=[accstream[index]] if accstream is not None else None,
+            ppgstream=[ppgstream[index]] if ppgstream is not None else None,
+            gyrstream=[gyrstream[index]] if gyrstream is not None else None,
+            filenames=[filenames[index]] if filenames is not None else None,
+            method=method,
+            tolerance=tolerance
+        )
+
+        # Recordings are converted one by one, so the label is numbered as in a single to_long_df of all of them
+        device = str(df['device'].cat.categories[0])
+        df['recording'] = df['recording'].cat.rename_categories([(str(index) + ' ' + device + ' ' + str(df['file'].cat.categories[0])).strip()])
+
+        # Partition folders of the recording. The device column is stored in the folder name.
+        partitions = []
+        if subjects is not None:
+            partitions.append('subject=' + str(subjects[index]))
+        if sessions is not None:
+            partitions.append('session=' + str(sessions[index]))
+        partitions.append('device=' + device)
+
+        folder = path.join(root, *partitions)
+        makedirs(folder, exist_ok=True)
+
+        if filenames is not None:
+            name = path.splitext(path.basename(filenames[index]))[0] + '.parquet'
+        else:
+            name = 'recording-' + str(index) + '.parquet'
+
+        table = pa.Table.from_pandas(df.drop(columns='device'), preserve_index=False)
+        pq.write_table(table, path.join(folder, name), row_group_size=row_group_size, compression=compression)
+        written.append(path.join(folder, name))
+
+    return written
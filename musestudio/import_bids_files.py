@@ -1,4 +1,15 @@
-from mne_bids import BIDSPath, read_raw_bids
+import json
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+from .instrumentation import Stage
+from mne_bids import BIDSPath, get_entities_from_fname, read_raw_bids
+from os import path, replace
+
+ENTITIES = ['subject', 'session', 'task', 'acquisition', 'run', 'processing', 'recording', 'space', 'split']
+EEG_EXTENSIONS = ['.vhdr', '.edf', '.bdf', '.set', '.fif']
+
+# Dataset indexes already loaded in this process, by root folder
+indexes = {}
 
 def import_bids(setup=None):
     '''Import recordings in BIDS format.
@@ -10,6 +21,9 @@ def import_bids(setup=None):
         Two arrays: the recordings as MNE RawArray instances, and the bids paths as MNE-BIDS BIDSPath instances.
     Raises:
         ValueError: if no setup is specified.
+    See also:
+        index_bids
+        load_bids
     '''
     if setup is None:
         raise(ValueError('Enter BIDS setup parameter array.'))
@@ -20,25 +34,176 @@ def import_bids(setup=None):
 
     # Iterate over the recordings setup to import from BIDS format
     for config in setup:
-        import_path = BIDSPath(
-            subject=(config['subject'] if 'subject' in config else None),
-            session=(config['session'] if 'session' in config else None),
-            task=(config['task'] if 'task' in config else None),
-            acquisition=(config['acquisition'] if 'acquisition' in config else None),
-            run=(config['run'] if 'run' in config else None),
-            processing=(config['processing'] if 'processing' in config else None),
-            recording=(config['recording'] if 'recording' in config else None),
-            space=(config['space'] if 'space' in config else None),
-            split=(config['split'] if 'split' in config else None),
-            suffix=(config['suffix'] if 'suffix' in config else None),
-            extension=(config['extension'] if 'extension' in config else None),
-            root=(config['root'] if 'root' in config else None),
-            datatype='eeg',
-            check=True
-        )
+        import_path = setup_to_bids_path(config)
 
         bids_paths.append(import_path)
 
-        raweeg.append(read_raw_bids(import_path))
+        with Stage('import_bids', import_path.basename) as stage:
+            raweeg.append(read_raw_bids(import_path))
+            stage.samples = raweeg[-1].n_times
+
+    return raweeg, bids_paths
+
+def index_bids(root = None, refresh = False):
+    '''Index the EEG recordings of a BIDS dataset.
+
+    The dataset is scanned once and its entity table is cached in memory and in
+    .musestudio_index.json inside the root, so later calls and queries do not walk
+    the directory tree again. Every entry follows the setup template of the README
+    and adds the path, sampling frequency and duration of the recording.
+
+    Args:
+        root : string
+            Root folder of the BIDS dataset.
+        refresh : bool
+            Scan the dataset again, e.g. after exporting new recordings.
+    Returns:
+        Array with one entry per recording.
+    Raises:
+        ValueError: if no root is specified.
+        RuntimeError: if the root folder does not exist.
+    See also:
+        query_bids
+        load_bids
+    '''
+    if root is None:
+        raise(ValueError('Enter the root folder of the BIDS dataset.'))
+
+    if not path.isdir(root):
+        raise(RuntimeError('BIDS root folder not found.'))
+
+    root = path.abspath(root)
+    index_file = path.join(root, '.musestudio_index.json')
+
+    if not refresh:
+        if root in indexes:
+            return indexes[root]
+        if path.exists(index_file):
+            with open(index_file, mode='r', encoding='utf-8') as f:
+                index = json.load(f)
+            # The dataset may have been moved since it was indexed
+            for entry in index:
+                entry['root'] = root
+            indexes[root] = index
+            return index
+
+    with Stage('index_bids', root):
+        index = scan_bids(root)
+
+    with open(index_file + '.tmp', mode='w', encoding='utf-8') as f:
+        json.dump(index, f, indent=1)
+    replace(index_file + '.tmp', index_file)
+
+    indexes[root] = index
+    return index
+
+def scan_bids(root):
+    '''Get the entities, sampling frequency and duration of every EEG recording of a BIDS root.'''
+    index = []
+    files = glob(path.join(root, 'sub-*', 'eeg', '*_eeg.*')) + glob(path.join(root, 'sub-*', 'ses-*', 'eeg', '*_eeg.*'))
+    for filename in sorted(files):
+        extension = path.splitext(filename)[1]
+        if extension not in EEG_EXTENSIONS:
+            continue
+
+        entities = get_entities_from_fname(path.basename(filename))
+        entry = {entity: entities.get(entity) for entity in ENTITIES}
+        entry.update({'root': root, 'suffix': 'eeg', 'extension': extension, 'path': path.relpath(filename, root), 'sfreq': None, 'duration': None})
+
+        # Sampling frequency and duration are read from the sidecar, without opening the signal
+        sidecar = filename[:-len(extension)] + '.json'
+        if path.exists(sidecar):
+            with open(sidecar, mode='r', encoding='utf-8') as f:
+                description = json.load(f)
+            entry['sfreq'] = description.get('SamplingFrequency')
+            entry['duration'] = description.get('RecordingDuration')
+
+        index.append(entry)
+
+    return index
+
+def query_bids(index = None, **entities):
+    '''Select recordings from a BIDS dataset index.
+
+    Args:
+        index : array
+            Dataset index created with index_bids.
+        entities : string or array
+            Values required for any entity of the index, e.g. task='rest' or subject=['01', '02'].
+    Returns:
+        Array with the entries of the index that match every entity.
+    Raises:
+        ValueError: if no index is specified or an entity is not valid.
+    See also:
+        index_bids
+        load_bids
+    '''
+    if index is None:
+        raise(ValueError('Enter a BIDS dataset index.'))
+
+    for entity in entities:
+        if entity not in ENTITIES + ['extension']:
+            raise(ValueError('Entity must be one of: ' + ', '.join(ENTITIES + ['extension']) + '.'))
+
+    selection = {entity: set(str(value) for value in (values if isinstance(values, list) else [values])) for entity, values in entities.items()}
+
+    return [entry for entry in index if all(str(entry[entity]) in values for entity, values in selection.items())]
+
+def load_bids(entries = None, n_jobs = 1):
+    '''Load recordings selected from a BIDS dataset index.
+
+    Recordings are opened without loading their data (preload=False). Signals are read
+    from disk only when they are used, e.g. with get_data or load_data.
+
+    Args:
+        entries : array
+            Entries of a dataset index, as returned by index_bids or query_bids.
+        n_jobs : int
+            Number of threads used to open the recordings.
+    Returns:
+        Two arrays: the recordings as MNE Raw instances, and the bids paths as MNE-BIDS BIDSPath instances.
+    Raises:
+        ValueError: if no entries are specified.
+    See also:
+        index_bids
+        query_bids
+    '''
+    if entries is None:
+        raise(ValueError('Enter the entries of the recordings to load.'))
+
+    entries = [entries] if not isinstance(entries, list) else entries
+    bids_paths = [setup_to_bids_path(entry) for entry in entries]
+
+    if n_jobs == 1:
+        raweeg = [read_recording(bids_path) for bids_path in bids_paths]
+    else:
+        with ThreadPoolExecutor(max_workers=None if n_jobs < 0 else n_jobs) as executor:
+            raweeg = list(executor.map(read_recording, bids_paths))
 
     return raweeg, bids_paths
+
+def read_recording(bids_path):
+    '''Open a recording in BIDS format without loading its data.'''
+    with Stage('load_bids', bids_path.basename) as stage:
+        raw = read_raw_bids(bids_path)
+        stage.samples = raw.n_times
+    return raw
+
+def setup_to_bids_path(config):
+    '''Create the BIDS path of a recording from its setup.'''
+    return BIDSPath(
+        subject=(config['subject'] if 'subject' in config else None),
+        session=(config['session'] if 'session' in config else None),
+        task=(config['task'] if 'task' in config else None),
+        acquisition=(config['acquisition'] if 'acquisition' in config else None),
+        run=(config['run'] if 'run' in config else None),
+        processing=(config['processing'] if 'processing' in config else None),
+        recording=(config['recording'] if 'recording' in config else None),
+        space=(config['space'] if 'space' in config else None),
+        split=(config['split'] if 'split' in config else None),
+        suffix=(config['suffix'] if 'suffix' in config else None),
+        extension=(config['extension'] if 'extension' in config else None),
+        root=(config['root'] if 'root' in config else None),
+        datatype='eeg',
+        check=True
+    )
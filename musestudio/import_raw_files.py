@@ -1,52 +1,257 @@
+import json
 import ntpath
+import numpy as np
+import struct
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from glob import glob
+from os import cpu_count, path, replace, stat
 from platform import system
-from pyxdf import load_xdf
+from .instrumentation import Stage, emit
+from .xdf_cache import load_cached
+from pyxdf import load_xdf, resolve_streams
+from warnings import warn
 
-def read_raw_xdf(filename = None):
+STREAM_TYPES = ['EEG', 'Accelerometer', 'PPG', 'Gyroscope']
+
+def read_raw_xdf(filename = None, stream_types = None, devices = None, tmin = None, tmax = None, relative_time = True, cache_dir = None, cache_size = None):
     '''Import a single XDF file format that contains one recording.
 
     Args:
         filename : string
             full path to a single recording
+        stream_types : array
+            Types of streams to decode: 'EEG', 'Accelerometer', 'PPG' or 'Gyroscope'. All if not specified.
+            Streams of other types are skipped without being decoded.
+        devices : array
+            Names of the Muse devices to decode (e.g. 'Muse-1A2B'). All if not specified.
+        tmin : float
+            Start of the time range to keep, included. Whole recording if not specified.
+        tmax : float
+            End of the time range to keep, excluded. Whole recording if not specified.
+        relative_time : bool
+            tmin and tmax are seconds from the first sample of the file. Otherwise they are LSL timestamps.
+        cache_dir : string
+            Directory of the parse cache. Repeated loads of an unchanged file are read from
+            memory-mapped arrays instead of decoding the XDF file again. Disabled if not specified.
+        cache_size : int
+            Maximum size of the parse cache in bytes. Least recently used files are evicted first.
     Returns:
         Four arrays containing the data for these streams: EEG, Accelerometer, PPG, Gyroscope.
         Additionally, another array is returned with the filename.
     Raises:
-        ValueError: if filename is not specified.
+        ValueError: if filename is not specified, a stream type is not valid or tmax is not greater than tmin.
         RuntimeError: if filename is not in XDF format or not file found.
     See also:
         read_raw_xdf_dir
+        iter_raw_xdf
     '''
-    if filename is None:
-        raise(ValueError('Enter XDF file path.'))
+    stream_types, devices = check_selection(stream_types, devices)
+    check_time_range(tmin, tmax)
+    return get_files(check_file(filename), stream_types=stream_types, devices=devices, tmin=tmin, tmax=tmax, relative_time=relative_time, cache_dir=cache_dir, cache_size=cache_size)
 
-    if system() == 'Windows':
-        filename = r'%s' % filename
-    
-    if not filename.endswith('.xdf'):
-        raise(RuntimeError('File type must be XDF.'))
-    
-    if len(glob(filename)) == 0:
-        raise(RuntimeError('XDF file not found.'))
+def iter_raw_xdf(filename = None, by_device = False, stream_types = None, devices = None, tmin = None, tmax = None, relative_time = True, cache_dir = None, cache_size = None):
+    '''Import a single XDF file lazily, one bundle of streams at a time.
 
-    return get_files(filename)
+    Args:
+        filename : string
+            full path to a single recording
+        by_device : bool
+            Yield one bundle per Muse device instead of one per file.
+        stream_types : array
+            Types of streams to decode: 'EEG', 'Accelerometer', 'PPG' or 'Gyroscope'. All if not specified.
+            Streams of other types are skipped without being decoded.
+        devices : array
+            Names of the Muse devices to decode (e.g. 'Muse-1A2B'). All if not specified.
+        tmin : float
+            Start of the time range to keep, included. Whole recording if not specified.
+        tmax : float
+            End of the time range to keep, excluded. Whole recording if not specified.
+        relative_time : bool
+            tmin and tmax are seconds from the first sample of the file. Otherwise they are LSL timestamps.
+        cache_dir : string
+            Directory of the parse cache. Disabled if not specified.
+        cache_size : int
+            Maximum size of the parse cache in bytes.
+    Yields:
+        Five arrays (EEG, Accelerometer, PPG, Gyroscope, filename) with the same layout
+        returned by read_raw_xdf, restricted to the file or device of the bundle.
+    Raises:
+        ValueError: if filename is not specified, a stream type is not valid or tmax is not greater than tmin.
+        RuntimeError: if filename is not in XDF format or not file found.
+    See also:
+        read_raw_xdf
+        iter_raw_xdf_dir
+    '''
+    stream_types, devices = check_selection(stream_types, devices)
+    check_time_range(tmin, tmax)
+    return iter_files(check_file(filename), by_device=by_device, stream_types=stream_types, devices=devices, tmin=tmin, tmax=tmax, relative_time=relative_time, cache_dir=cache_dir, cache_size=cache_size)
 
-def read_raw_xdf_dir(dirname = None):
+def read_raw_xdf_dir(dirname = None, n_jobs = 1, stream_types = None, devices = None, tmin = None, tmax = None, relative_time = True, cache_dir = None, cache_size = None, incremental = False, manifest = None):
     '''Import a directory with multiple recordings in XDF format.
 
     Args:
         dirname : string
             full path to directory
+        n_jobs : int
+            Number of processes used to parse the files. Use -1 for all CPUs.
+            Unless it is 1, files that fail to load or crash their process are reported with a warning and skipped.
+        stream_types : array
+            Types of streams to decode: 'EEG', 'Accelerometer', 'PPG' or 'Gyroscope'. All if not specified.
+            Streams of other types are skipped without being decoded.
+        devices : array
+            Names of the Muse devices to decode (e.g. 'Muse-1A2B'). All if not specified.
+        tmin : float
+            Start of the time range to keep, included. Whole recording if not specified.
+        tmax : float
+            End of the time range to keep, excluded. Whole recording if not specified.
+        relative_time : bool
+            tmin and tmax are seconds from the first sample of the file. Otherwise they are LSL timestamps.
+        cache_dir : string
+            Directory of the parse cache. Repeated loads of an unchanged file are read from
+            memory-mapped arrays instead of decoding the XDF file again. Disabled if not specified.
+        cache_size : int
+            Maximum size of the parse cache in bytes. Least recently used files are evicted first.
+        incremental : bool
+            Only parse the files that are new or changed since the previous incremental run.
+            Processed files are recorded in a manifest with their size, modification time, streams
+            and the selection loaded (stream types, devices and time range). Files processed with
+            a different selection are parsed again.
+        manifest : string
+            Path of the manifest used in incremental mode. Defaults to .musestudio_manifest.json in dirname.
     Returns:
         Four arrays containing the data for these streams: EEG, Accelerometer, PPG, Gyroscope.
         Additionally, another array is returned with the filenames
     Raises:
-        ValueError: if dirname is not specified
+        ValueError: if dirname is not specified, n_jobs is 0, a stream type is not valid or tmax is not greater than tmin
+        RuntimeError: if files are not found
+    See also:
+        read_raw_xdf
+        iter_raw_xdf_dir
+    '''
+    check_jobs(n_jobs)
+    stream_types, devices = check_selection(stream_types, devices)
+    check_time_range(tmin, tmax)
+    return get_files(check_dir(dirname), n_jobs, manifest=check_manifest(dirname, incremental, manifest), stream_types=stream_types, devices=devices, tmin=tmin, tmax=tmax, relative_time=relative_time, cache_dir=cache_dir, cache_size=cache_size)
+
+def iter_raw_xdf_dir(dirname = None, n_jobs = 1, by_device = False, stream_types = None, devices = None, tmin = None, tmax = None, relative_time = True, cache_dir = None, cache_size = None, incremental = False, manifest = None):
+    '''Import a directory with multiple recordings in XDF format lazily, one file at a time.
+
+    Only the files being parsed are held in memory, so every bundle can be converted
+    or exported and then released before the next one is loaded.
+
+    Args:
+        dirname : string
+            full path to directory
+        n_jobs : int
+            Number of processes used to parse the files. Use -1 for all CPUs.
+            Unless it is 1, files that fail to load or crash their process are reported with a warning and skipped.
+        by_device : bool
+            Yield one bundle per Muse device instead of one per file.
+        stream_types : array
+            Types of streams to decode: 'EEG', 'Accelerometer', 'PPG' or 'Gyroscope'. All if not specified.
+            Streams of other types are skipped without being decoded.
+        devices : array
+            Names of the Muse devices to decode (e.g. 'Muse-1A2B'). All if not specified.
+        tmin : float
+            Start of the time range to keep, included. Whole recording if not specified.
+        tmax : float
+            End of the time range to keep, excluded. Whole recording if not specified.
+        relative_time : bool
+            tmin and tmax are seconds from the first sample of the file. Otherwise they are LSL timestamps.
+        cache_dir : string
+            Directory of the parse cache. Disabled if not specified.
+        cache_size : int
+            Maximum size of the parse cache in bytes.
+        incremental : bool
+            Only parse the files that are new or changed since the previous incremental run.
+            Processed files are recorded in a manifest with their size, modification time, streams
+            and the selection loaded (stream types, devices and time range). Files processed with
+            a different selection are parsed again.
+        manifest : string
+            Path of the manifest used in incremental mode. Defaults to .musestudio_manifest.json in dirname.
+    Yields:
+        Five arrays (EEG, Accelerometer, PPG, Gyroscope, filename) with the same layout
+        returned by read_raw_xdf_dir, restricted to the file or device of the bundle.
+    Raises:
+        ValueError: if dirname is not specified, n_jobs is 0, a stream type is not valid or tmax is not greater than tmin
         RuntimeError: if files are not found
+    See also:
+        read_raw_xdf_dir
+        iter_raw_xdf
+    '''
+    check_jobs(n_jobs)
+    stream_types, devices = check_selection(stream_types, devices)
+    check_time_range(tmin, tmax)
+    return iter_files(check_dir(dirname), n_jobs, by_device, manifest=check_manifest(dirname, incremental, manifest), stream_types=stream_types, devices=devices, tmin=tmin, tmax=tmax, relative_time=relative_time, cache_dir=cache_dir, cache_size=cache_size)
+
+def iter_raw_xdf_chunks(filename = None, chunk_duration = None, stream_types = None, devices = None, tmin = None, tmax = None, relative_time = True, cache_dir = None, cache_size = None):
+    '''Import a single XDF file in blocks of fixed duration.
+
+    Every block contains the samples of each stream between its start (included) and
+    its end (excluded). The arrays of the blocks are views of the loaded streams. When
+    the parse cache is enabled they are memory maps, so only the samples of the block
+    are read from disk and peak memory depends on chunk_duration, not on the length
+    of the recording.
+
+    Args:
+        filename : string
+            full path to a single recording
+        chunk_duration : float
+            Duration of every block in seconds.
+        stream_types : array
+            Types of streams to decode: 'EEG', 'Accelerometer', 'PPG' or 'Gyroscope'. All if not specified.
+        devices : array
+            Names of the Muse devices to decode (e.g. 'Muse-1A2B'). All if not specified.
+        tmin : float
+            Start of the first block. First sample of the recording if not specified.
+        tmax : float
+            End of the last block, excluded. Last sample of the recording if not specified.
+        relative_time : bool
+            tmin and tmax are seconds from the first sample of the file. Otherwise they are LSL timestamps.
+        cache_dir : string
+            Directory of the parse cache. Disabled if not specified.
+        cache_size : int
+            Maximum size of the parse cache in bytes.
+    Yields:
+        Five arrays (EEG, Accelerometer, PPG, Gyroscope, filename) with the same layout
+        returned by read_raw_xdf, restricted to the samples of the block.
+    Raises:
+        ValueError: if filename or chunk_duration are not specified, a stream type is not valid or tmax is not greater than tmin.
+        RuntimeError: if filename is not in XDF format or not file found.
     See also:
         read_raw_xdf
+        iter_raw_xdf
     '''
+    filename = check_file(filename)
+
+    if chunk_duration is None or chunk_duration <= 0:
+        raise(ValueError('Enter a positive chunk duration in seconds.'))
+
+    stream_types, devices = check_selection(stream_types, devices)
+    check_time_range(tmin, tmax)
+
+    return iter_chunks(filename, chunk_duration, tmin, tmax, relative_time, stream_types=stream_types, devices=devices, cache_dir=cache_dir, cache_size=cache_size)
+
+def check_file(filename):
+    '''Check that a single XDF file exists and return its path.'''
+    if filename is None:
+        raise(ValueError('Enter XDF file path.'))
+
+    if system() == 'Windows':
+        filename = r'%s' % filename
+    
+    if not filename.endswith('.xdf'):
+        raise(RuntimeError('File type must be XDF.'))
+    
+    if len(glob(filename)) == 0:
+        raise(RuntimeError('XDF file not found.'))
+
+    return filename
+
+def check_dir(dirname):
+    '''Check that a directory contains XDF files and return the glob pattern to find them.'''
     if dirname is None:
         raise(ValueError('Enter XDF files directory name.'))
 
@@ -65,28 +270,26 @@ def read_raw_xdf_dir(dirname = None):
     if len(glob(dirname_xdf)) == 0:
         raise(RuntimeError('XDF files not found in directory.'))
     
-    return get_files(dirname_xdf)
+    return dirname_xdf
 
-def load_data(filename):
+def load_data(filename, stream_types = None, devices = None, tmin = None, tmax = None, relative_time = True, cache_dir = None, cache_size = None):
     '''Get recordings from a single XDF file and order streams by device.'''
-    # Load XDF file
-    streams = load_xdf(filename)
-    
-    streameeg, streamacc, streamppg, streamgyr, device_name = [], [], [], [], []
+    stream_types, devices = check_selection(stream_types, devices)
+
+    # Load XDF file, through the parse cache if enabled
+    if cache_dir is not None:
+        key_extra = repr(stream_types) + repr(devices)
+        streams = load_cached(filename, lambda f: decode_xdf(f, stream_types, devices), cache_dir, cache_size, key_extra)
+    else:
+        streams = decode_xdf(filename, stream_types, devices)
     
-    # Get the individual names of every Muse device
-    for stream in streams[0]:
-        name = stream['info']['name'][0][:9]
-        if name not in device_name:
-            device_name.append(name)
+    streameeg, streamacc, streamppg, streamgyr = [], [], [], []
     
-    # Order the streams in a new list based on the name of the device
-    streams_ordered = []
-    for item in device_name:
-        if len(streams_ordered) < (len(device_name)*4)+len(device_name):
-            for stream in streams[0]:
-                if item == stream['info']['name'][0][:9]:
-                    streams_ordered.append(stream)
+    # Group the streams by the name of the device in a single pass, keeping the order in which devices appear
+    streams_by_device = {}
+    for stream in crop_streams(streams[0], tmin, tmax, relative_time, filename):
+        streams_by_device.setdefault(stream['info']['name'][0][:9], []).append(stream)
+    streams_ordered = [stream for device_streams in streams_by_device.values() for stream in device_streams]
     
     # Insert each stream inside a file into the corresponding list
     for stream in streams_ordered:
@@ -101,24 +304,309 @@ def load_data(filename):
     
     return streameeg, streamacc, streamppg, streamgyr
 
-def get_files(files):
-    '''Get files from directory and insert recordings into arrays.'''
+def crop_streams(streams, tmin = None, tmax = None, relative_time = True, filename = None):
+    '''Keep the samples of every stream between tmin (included) and tmax (excluded).'''
+    if tmin is None and tmax is None:
+        return streams
+
+    # Relative times start at the first sample of the file, whatever streams are selected
+    origin = file_origin(filename) if relative_time else 0.0
+    start = -np.inf if tmin is None else origin + tmin
+    stop = np.inf if tmax is None else origin + tmax
+
+    return [crop_stream(stream, start, stop) for stream in streams]
+
+def crop_stream(stream, start, stop, view = False):
+    '''Slice a stream between two LSL timestamps.
+
+    The samples are copied, so the rest of the recording can be released, unless they
+    are memory maps of the parse cache or a view is requested.
+    '''
+    first, last = np.searchsorted(stream['time_stamps'], [start, stop], side='left')
+    cropped = dict(stream)
+    for key in ['time_series', 'time_stamps']:
+        cropped[key] = stream[key][first:last]
+        if not view and isinstance(stream[key], np.ndarray) and not isinstance(stream[key], np.memmap):
+            cropped[key] = cropped[key].copy()
+    return cropped
+
+def file_origin(filename):
+    '''Get the first LSL timestamp of all the streams of an XDF file.
+
+    Only the chunk headers and the first sample of every stream are read, so the origin
+    is the same whatever streams are decoded. Clock offsets are applied as pyxdf does.
+    '''
+    first_samples, offsets = {}, {}
+    with open(filename, mode='rb') as f:
+        f.read(4)
+        try:
+            while True:
+                length_size = f.read(1)
+                if len(length_size) == 0:
+                    break
+                length = int.from_bytes(f.read(ord(length_size)), 'little')
+                chunk_end = f.tell() + length
+                tag = struct.unpack('<H', f.read(2))[0]
+                if tag == 3 or tag == 4:
+                    stream_id = struct.unpack('<I', f.read(4))[0]
+                    if tag == 3 and stream_id not in first_samples:
+                        # Number of samples, then the size of the first timestamp and the timestamp
+                        f.read(ord(f.read(1)))
+                        if f.read(1) == b'\x08':
+                            first_samples[stream_id] = struct.unpack('<d', f.read(8))[0]
+                    elif tag == 4 and stream_id not in offsets:
+                        offsets[stream_id] = struct.unpack('<dd', f.read(16))[1]
+                f.seek(chunk_end)
+        except (struct.error, TypeError):
+            # Truncated files are read up to the last complete chunk
+            pass
+
+    timestamps = [timestamp + offsets.get(stream_id, 0.0) for stream_id, timestamp in first_samples.items()]
+    return float(min(timestamps)) if len(timestamps) > 0 else 0.0
+
+def first_timestamp(streams):
+    '''Get the earliest LSL timestamp of a group of streams.'''
+    timestamps = [stream['time_stamps'][0] for stream in streams if len(stream['time_stamps']) > 0]
+    return float(min(timestamps)) if len(timestamps) > 0 else 0.0
+
+def last_timestamp(streams):
+    '''Get the latest LSL timestamp of a group of streams.'''
+    timestamps = [stream['time_stamps'][-1] for stream in streams if len(stream['time_stamps']) > 0]
+    return float(max(timestamps)) if len(timestamps) > 0 else 0.0
+
+def check_jobs(n_jobs = 1):
+    '''Check the number of processes used to parse files.'''
+    if n_jobs is None or n_jobs == 0:
+        raise(ValueError('n_jobs must be a positive integer or -1.'))
+
+def check_time_range(tmin = None, tmax = None):
+    '''Check the time range selected for loading.'''
+    if tmin is not None and tmax is not None and tmax <= tmin:
+        raise(ValueError('tmax must be greater than tmin.'))
+
+def check_selection(stream_types = None, devices = None):
+    '''Check the stream types and devices selected for loading.'''
+    if stream_types is not None:
+        stream_types = [stream_types] if not isinstance(stream_types, list) else stream_types
+        for stream_type in stream_types:
+            if stream_type not in STREAM_TYPES:
+                raise(ValueError('Stream type must be one of: ' + ', '.join(STREAM_TYPES) + '.'))
+        stream_types = sorted(stream_types)
+
+    if devices is not None:
+        devices = [devices] if not isinstance(devices, list) else devices
+        devices = sorted(device[:9] for device in devices)
+
+    return stream_types, devices
+
+def decode_xdf(filename, stream_types = None, devices = None):
+    '''Decode an XDF file, skipping the streams that do not match the selected types and devices.'''
+    if stream_types is None and devices is None:
+        return load_xdf(filename)
+
+    # Read only the stream headers to find the identifiers of the selected streams
+    stream_ids = []
+    for info in resolve_streams(filename):
+        if stream_types is not None and not any(stream_type in info['type'] for stream_type in stream_types):
+            continue
+        if devices is not None and info['name'][:9] not in devices:
+            continue
+        stream_ids.append(info['stream_id'])
+
+    if len(stream_ids) == 0:
+        return [], {}
+
+    return load_xdf(filename, select_streams=stream_ids)
+
+def iter_chunks(filename, chunk_duration, tmin = None, tmax = None, relative_time = True, **load_options):
+    '''Load a single file and yield its streams in blocks of fixed duration.'''
+    streameeg, streamacc, streamppg, streamgyr = load_data(filename, **load_options)
+    all_streams = streameeg + streamacc + streamppg + streamgyr
+
+    origin = file_origin(filename) if relative_time else 0.0
+    start = first_timestamp(all_streams) if tmin is None else origin + tmin
+    stop = np.nextafter(last_timestamp(all_streams), np.inf) if tmax is None else origin + tmax
+
+    while start < stop:
+        end = min(start + chunk_duration, stop)
+        yield (
+            [crop_stream(stream, start, end, view=True) for stream in streameeg],
+            [crop_stream(stream, start, end, view=True) for stream in streamacc],
+            [crop_stream(stream, start, end, view=True) for stream in streamppg],
+            [crop_stream(stream, start, end, view=True) for stream in streamgyr],
+            [ntpath.basename(filename)] * len(streameeg)
+        )
+        start = end
+
+def check_manifest(dirname, incremental = False, manifest = None):
+    '''Get the path of the manifest of processed files used in incremental mode.'''
+    if not incremental:
+        return None
+    return manifest if manifest is not None else path.join(dirname, '.musestudio_manifest.json')
+
+def read_manifest(manifest):
+    '''Read the manifest of processed files. Empty if it does not exist yet.'''
+    if not path.exists(manifest):
+        return {}
+    with open(manifest, mode='r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_manifest(manifest, processed):
+    '''Write the manifest of processed files atomically.'''
+    with open(manifest + '.tmp', mode='w', encoding='utf-8') as f:
+        json.dump(processed, f, indent=1, sort_keys=True)
+    replace(manifest + '.tmp', manifest)
+
+def file_summary(filename):
+    '''Get the size and modification time of a file.'''
+    file_stat = stat(filename)
+    return {'size': file_stat.st_size, 'mtime': file_stat.st_mtime_ns}
+
+def load_selection(stream_types = None, devices = None, tmin = None, tmax = None, relative_time = True, **cache_options):
+    '''Get the streams and time range selected for loading, as stored in the manifest.'''
+    return {'stream_types': stream_types, 'devices': devices, 'tmin': tmin, 'tmax': tmax, 'relative_time': relative_time}
+
+def streams_summary(streams_file):
+    '''Get the name, type and number of samples of the streams loaded from a file.'''
+    return [
+        {'name': stream['info']['name'][0], 'type': stream['info']['type'][0], 'samples': len(stream['time_stamps'])}
+        for streams in streams_file for stream in streams
+    ]
+
+def count_samples(streams_file):
+    '''Get the number of samples of the streams loaded from a file.'''
+    return sum(len(stream['time_stamps']) for streams in streams_file for stream in streams)
+
+def load_data_safe(filename, **load_options):
+    '''Get recordings from a single XDF file, returning the error instead of raising it, and the measures of the stage.'''
+    try:
+        with Stage('read_xdf', filename, bytes=path.getsize(filename), deferred=True) as stage:
+            streams_file = load_data(filename, **load_options)
+            stage.samples = count_samples(streams_file)
+        return streams_file, None, stage.event
+    except Exception as error:
+        return None, error, None
+
+def iter_serial(files, **load_options):
+    '''Parse files one after another and yield them in order.'''
+    for f in files:
+        with Stage('read_xdf', f, bytes=path.getsize(f)) as stage:
+            streams_file = load_data(f, **load_options)
+            stage.samples = count_samples(streams_file)
+        yield f, streams_file, None, None
+        # Release the file before parsing the next one
+        del streams_file
+
+def iter_files(files, n_jobs = 1, by_device = False, manifest = None, **load_options):
+    '''Get files from directory and yield the recordings of each file.'''
     # Get files from directory path
     files = sorted(glob(files))
-    
+
+    # Skip the files already processed in previous runs with the same selection. Size and modification time are taken before parsing.
+    if manifest is not None:
+        processed = read_manifest(manifest)
+        summaries = {f: file_summary(f) for f in files}
+        selection = load_selection(**load_options)
+        files = [f for f in files if processed.get(ntpath.basename(f), {}).get('file') != summaries[f] or processed[ntpath.basename(f)].get('selection') != selection]
+
+    # Failures are handled the same way whatever the number of files left
+    if n_jobs != 1:
+        results = iter_parallel(files, n_jobs, **load_options)
+    else:
+        results = iter_serial(files, **load_options)
+
+    updated = False
+    try:
+        for f, streams_file, error, event in results:
+            # Stages measured in other processes are reported here
+            if event is not None:
+                emit(event)
+            if error is not None:
+                warn('Could not load ' + f + ': ' + repr(error))
+                continue
+            summary = streams_summary(streams_file) if manifest is not None else None
+            streameeg_file, streamacc_file, streamppg_file, streamgyr_file = streams_file
+            if by_device:
+                for bundle in split_by_device(streameeg_file, streamacc_file, streamppg_file, streamgyr_file):
+                    yield bundle + ([ntpath.basename(f)] * len(bundle[0]),)
+                    del bundle
+            else:
+                yield streameeg_file, streamacc_file, streamppg_file, streamgyr_file, [ntpath.basename(f)] * len(streameeg_file)
+            # Once consumed, the recordings of the file are released before the next file is parsed
+            del streams_file, streameeg_file, streamacc_file, streamppg_file, streamgyr_file
+
+            # The file is recorded once its recordings have been consumed
+            if manifest is not None:
+                processed[ntpath.basename(f)] = {'file': summaries[f], 'selection': selection, 'streams': summary}
+                updated = True
+    finally:
+        if updated:
+            write_manifest(manifest, processed)
+
+def load_data_isolated(filename, **load_options):
+    '''Parse a single XDF file in its own process, returning the error if the process dies.'''
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        try:
+            return executor.submit(load_data_safe, filename, **load_options).result()
+        except BrokenProcessPool as error:
+            return None, error, None
+
+def iter_parallel(files, n_jobs, **load_options):
+    '''Parse files in a process pool and yield them in order, keeping a bounded number in flight.
+
+    When a worker dies, e.g. out of memory or in a crash of the parser, the pool is replaced
+    and the files it was parsing are parsed again one at a time, so only the file that
+    crashed is skipped.
+    '''
+    max_workers = cpu_count() if n_jobs < 0 else n_jobs
+    max_pending = max_workers * 2
+    files = deque(files)
+    pending = deque()
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        while files or pending:
+            while files and len(pending) < max_pending:
+                f = files.popleft()
+                pending.append((f, executor.submit(load_data_safe, f, **load_options)))
+
+            f_done, future = pending.popleft()
+            if future is None:
+                result = load_data_isolated(f_done, **load_options)
+            else:
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    executor.shutdown(wait=False)
+                    executor = ProcessPoolExecutor(max_workers=max_workers)
+                    # Files parsed before the crash keep their results
+                    pending = deque((f, future if future.done() and future.exception() is None else None) for f, future in pending)
+                    result = load_data_isolated(f_done, **load_options)
+            yield (f_done,) + result
+            del future, result
+    finally:
+        executor.shutdown()
+
+def split_by_device(streameeg, streamacc, streamppg, streamgyr):
+    '''Split the streams of a file into one bundle per Muse device.'''
+    devices = {}
+    for position, streams in enumerate([streameeg, streamacc, streamppg, streamgyr]):
+        for stream in streams:
+            name = stream['info']['name'][0][:9]
+            if name not in devices:
+                devices[name] = ([], [], [], [])
+            devices[name][position].append(stream)
+    return list(devices.values())
+
+def get_files(files, n_jobs = 1, manifest = None, **load_options):
+    '''Get files from directory and insert recordings into arrays.'''
     streameeg, streamacc, streamppg, streamgyr, filename = [], [], [], [], []
     
     # Search XDF files and add individual channels to the corresponding list. Store the name of the file.
-    for f in files:
-        streameeg_file, streamacc_file, streamppg_file, streamgyr_file = load_data(f)
-        for item in streameeg_file:
-            streameeg.append(item)
-            filename.append(ntpath.basename(f))
-        for item in streamacc_file:
-            streamacc.append(item)
-        for item in streamppg_file:
-            streamppg.append(item)
-        for item in streamgyr_file:
-            streamgyr.append(item)
+    for streameeg_file, streamacc_file, streamppg_file, streamgyr_file, filename_file in iter_files(files, n_jobs, manifest=manifest, **load_options):
+        streameeg.extend(streameeg_file)
+        streamacc.extend(streamacc_file)
+        streamppg.extend(streamppg_file)
+        streamgyr.extend(streamgyr_file)
+        filename.extend(filename_file)
     
     return streameeg, streamacc, streamppg, streamgyr, filename
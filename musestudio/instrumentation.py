@@ -0,0 +1,117 @@
+import tracemalloc
+from logging import INFO, Logger
+from sys import platform
+from time import perf_counter, process_time
+
+try:
+    from resource import RUSAGE_SELF, getrusage
+except ImportError:
+    # Not available on Windows
+    getrusage = None
+
+# Callables and loggers receiving the events of every stage
+handlers = []
+# Progress messages are printed when True
+verbose = True
+
+def add_handler(handler):
+    '''Receive an event when a processing stage finishes.
+
+    Events are dictionaries with the keys: stage ('read_xdf', 'to_mne_eeg', 'to_df',
+    'to_long_df', 'export_bids', 'import_bids', 'index_bids', 'load_bids' or 'view_update'),
+    recording, samples, bytes, wall and cpu (seconds) and peak_memory (bytes). Peak memory
+    is the peak traced during the stage when tracemalloc is tracing, otherwise the peak
+    resident memory of the process. Stages run in other processes (n_jobs) are reported
+    once their results are received. Stages run in threads, e.g. the live view, call
+    handlers from those threads.
+
+    Args:
+        handler : callable or logging.Logger
+            Function called with every event, or logger where events are logged at INFO level.
+    See also:
+        remove_handler
+        set_verbose
+    '''
+    if handler not in handlers:
+        handlers.append(handler)
+
+def remove_handler(handler):
+    '''Stop sending events to a handler added with add_handler.'''
+    if handler in handlers:
+        handlers.remove(handler)
+
+def set_verbose(value = True):
+    '''Show or hide the progress messages printed while processing recordings.'''
+    global verbose
+    verbose = value
+
+def report(*values):
+    '''Print a progress message if verbose.'''
+    if verbose:
+        print(*values)
+
+def emit(event):
+    '''Send an event to every handler.'''
+    for handler in handlers:
+        if isinstance(handler, Logger):
+            handler.log(INFO, '%s %s: %.3f s wall, %.3f s cpu, %s samples', event['stage'], event['recording'], event['wall'], event['cpu'], event['samples'], extra={'musestudio': event})
+        else:
+            handler(event)
+
+def peak_memory():
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[1]
+    if getrusage is not None:
+        # Kilobytes on Linux, bytes on macOS
+        return getrusage(RUSAGE_SELF).ru_maxrss * (1 if platform == 'darwin' else 1024)
+    return None
+
+class Stage:
+    '''Measure a processing stage and send its event to the handlers.
+
+    Without handlers nothing is measured. Samples and bytes can be set inside the block,
+    once they are known.
+
+    Args:
+        name : string
+            Name of the stage.
+        recording : string
+            Recording processed.
+        samples : int
+            Number of samples processed.
+        bytes : int
+            Number of bytes processed.
+        deferred : bool
+            Always measure, but do not send the event. It is kept in the event attribute,
+            e.g. to be sent by the main process with emit.
+    '''
+    def __init__(self, name, recording = None, samples = None, bytes = None, deferred = False):
+        self.name = name
+        self.recording = recording
+        self.samples = samples
+        self.bytes = bytes
+        self.deferred = deferred
+        self.event = None
+
+    def __enter__(self):
+        self.active = self.deferred or len(handlers) > 0
+        if self.active:
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            self.start_cpu = process_time()
+            self.start_wall = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.active and exc_type is None:
+            self.event = {
+                'stage': self.name,
+                'recording': self.recording,
+                'samples': self.samples,
+                'bytes': self.bytes,
+                'wall': perf_counter() - self.start_wall,
+                'cpu': process_time() - self.start_cpu,
+                'peak_memory': peak_memory()
+            }
+            if not self.deferred:
+                emit(self.event)
@@ -0,0 +1,274 @@
+import numpy as np
+import struct
+from .acquisition import StreamReader
+from .instrumentation import report
+from .ring_buffer import RingBuffer
+from os import fsync
+from queue import Full, Queue
+from threading import Thread
+from time import monotonic, sleep
+from xml.sax.saxutils import escape
+
+# Tags of the XDF chunks
+FILE_HEADER = 1
+STREAM_HEADER = 2
+SAMPLES = 3
+CLOCK_OFFSET = 4
+STREAM_FOOTER = 6
+
+# Sample types of the LSL channel formats
+CHANNEL_FORMATS = {
+    'float32': np.float32,
+    'double64': np.float64,
+    'int8': np.int8,
+    'int16': np.int16,
+    'int32': np.int32,
+    'int64': np.int64
+}
+
+class XdfWriter:
+    '''Writer of XDF files, the format used by LabRecorder and read by read_raw_xdf.
+
+    Samples are written in chunks as they arrive, and every chunk is complete on disk
+    after flush, so a recording interrupted by a crash can still be read up to the last
+    flushed chunk.
+
+    Args:
+        filename : string
+            Full path of the XDF file to create.
+    '''
+    def __init__(self, filename):
+        self.file = open(filename, mode='wb')
+        self.file.write(b'XDF:')
+        self.write_chunk(FILE_HEADER, b'<?xml version="1.0"?><info><version>1.0</version></info>')
+        self.formats = {}
+        self.footers = {}
+
+    def add_stream(self, stream_id, header):
+        '''Add a stream to the file.
+
+        Args:
+            stream_id : int
+                Identifier of the stream in the file.
+            header : string
+                XML description of the stream, e.g. from pylsl.StreamInfo.as_xml.
+        '''
+        channel_format = header.split('<channel_format>')[1].split('</channel_format>')[0]
+        self.formats[stream_id] = CHANNEL_FORMATS.get(channel_format, 'string')
+        self.footers[stream_id] = {'first_timestamp': None, 'last_timestamp': None, 'sample_count': 0, 'clock_offsets': []}
+        self.write_chunk(STREAM_HEADER, struct.pack('<I', stream_id) + header.encode('utf-8'))
+
+    def write_samples(self, stream_id, samples, timestamps):
+        '''Write a chunk of samples of a stream.
+
+        Args:
+            stream_id : int
+                Identifier of the stream in the file.
+            samples : array, shape(n_samples, n_channels)
+                Samples of the chunk.
+            timestamps : array, shape(n_samples,)
+                Timestamps of the samples.
+        '''
+        n_samples = len(timestamps)
+        if n_samples == 0:
+            return
+
+        dtype = self.formats[stream_id]
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if dtype == 'string':
+            content = b''.join(
+                b'\x08' + struct.pack('<d', timestamp) + b''.join(varlen_int(len(value)) + value for value in (str(value).encode('utf-8') for value in sample))
+                for timestamp, sample in zip(timestamps, samples)
+            )
+        else:
+            # Every sample is stored as: size of the timestamp (8 bytes), timestamp and values
+            values = np.ascontiguousarray(samples, dtype=np.dtype(dtype).newbyteorder('<')).reshape(n_samples, -1)
+            rows = np.empty(n_samples, dtype=[('size', 'u1'), ('timestamp', '<f8'), ('values', values.dtype, (values.shape[1],))])
+            rows['size'] = 8
+            rows['timestamp'] = timestamps
+            rows['values'] = values
+            content = rows.tobytes()
+
+        self.write_chunk(SAMPLES, struct.pack('<I', stream_id) + varlen_int(n_samples) + content)
+
+        footer = self.footers[stream_id]
+        if footer['first_timestamp'] is None:
+            footer['first_timestamp'] = float(timestamps[0])
+        footer['last_timestamp'] = float(timestamps[-1])
+        footer['sample_count'] += n_samples
+
+    def write_clock_offset(self, stream_id, collection_time, offset):
+        '''Write the clock offset of a stream, used to synchronize streams of different computers.'''
+        self.footers[stream_id]['clock_offsets'].append((collection_time, offset))
+        self.write_chunk(CLOCK_OFFSET, struct.pack('<Idd', stream_id, collection_time, offset))
+
+    def flush(self):
+        '''Write the pending chunks to disk.'''
+        self.file.flush()
+        fsync(self.file.fileno())
+
+    def close(self):
+        '''Write the footers of the streams and close the file.'''
+        for stream_id, footer in self.footers.items():
+            offsets = ''.join(
+                '<offset><time>' + repr(collection_time) + '</time><value>' + repr(offset) + '</value></offset>'
+                for collection_time, offset in footer['clock_offsets']
+            )
+            xml = (
+                '<?xml version="1.0"?><info>'
+                + '<first_timestamp>' + escape(repr(footer['first_timestamp'] or 0.0)) + '</first_timestamp>'
+                + '<last_timestamp>' + escape(repr(footer['last_timestamp'] or 0.0)) + '</last_timestamp>'
+                + '<sample_count>' + str(footer['sample_count']) + '</sample_count>'
+                + '<clock_offsets>' + offsets + '</clock_offsets></info>'
+            )
+            self.write_chunk(STREAM_FOOTER, struct.pack('<I', stream_id) + xml.encode('utf-8'))
+        self.flush()
+        self.file.close()
+
+    def write_chunk(self, tag, content):
+        self.file.write(varlen_int(len(content) + 2) + struct.pack('<H', tag) + content)
+
+def varlen_int(value):
+    '''Encode an integer with the variable length format of XDF.'''
+    if value < 256:
+        return struct.pack('<BB', 1, value)
+    if value < 4294967296:
+        return struct.pack('<BI', 4, value)
+    return struct.pack('<BQ', 8, value)
+
+class StreamRecorder(Thread):
+    '''Thread that writes the chunks acquired from LSL inlets to an XDF file.
+
+    Readers add chunks to a bounded queue and the thread writes them to disk, so slow
+    disks never delay acquisition or the user interface. When the queue is full, readers
+    wait for the writer to catch up instead of dropping samples.
+
+    Args:
+        filename : string
+            Full path of the XDF file to create.
+        inlets : array
+            LSL streams recorded, as pylsl.StreamInlet instances.
+        max_chunks : int
+            Maximum number of chunks waiting to be written.
+        flush_interval : float
+            Seconds between writes of the file to disk.
+        clock_interval : float
+            Seconds between measures of the clock offset of every stream.
+        clock_timeout : float
+            Maximum seconds waiting for the clock offset of a stream. Offsets of streams that
+            do not answer in time, e.g. disconnected devices, are skipped until the next measure.
+    See also:
+        StreamReader
+    '''
+    def __init__(self, filename, inlets, max_chunks = 256, flush_interval = 1, clock_interval = 5, clock_timeout = 0.2):
+        super().__init__(daemon=True, name='musestudio-recorder')
+        self.filename = filename
+        self.inlets = inlets
+        self.queue = Queue(maxsize=max_chunks)
+        self.flush_interval = flush_interval
+        self.clock_interval = clock_interval
+        self.clock_timeout = clock_timeout
+        self.error = None
+        self.writer = XdfWriter(filename)
+        for stream_id, inlet in enumerate(inlets):
+            self.writer.add_stream(stream_id, inlet.info().as_xml())
+
+    def add_chunk(self, stream_id, samples, timestamps):
+        '''Queue a chunk of samples to be written. Waits while the queue is full.'''
+        if self.error is not None:
+            raise(RuntimeError('Recording to ' + self.filename + ' failed: ' + str(self.error)))
+        self.queue.put((stream_id, samples, timestamps))
+
+    def run(self):
+        last_flush = last_clock = monotonic()
+        try:
+            self.write_clock_offsets()
+            while True:
+                chunk = self.queue.get()
+                if chunk is None:
+                    break
+                self.writer.write_samples(*chunk)
+
+                if monotonic() - last_clock > self.clock_interval:
+                    self.write_clock_offsets()
+                    last_clock = monotonic()
+                if monotonic() - last_flush > self.flush_interval:
+                    self.writer.flush()
+                    last_flush = monotonic()
+        except Exception as error:
+            self.error = error
+            # Readers waiting on a full queue are released until the recorder is stopped
+            while self.queue.get() is not None:
+                pass
+        finally:
+            self.writer.close()
+
+    def write_clock_offsets(self):
+        # LSL is only needed while recording, XdfWriter works without it
+        from pylsl import local_clock
+        try:
+            from pylsl.util import LostError, TimeoutError
+        except ImportError:
+            # pylsl < 1.17
+            from pylsl.pylsl import LostError, TimeoutError
+
+        for stream_id, inlet in enumerate(self.inlets):
+            # The default timeout would block the writer, and then the readers, while a device is disconnected
+            try:
+                offset = inlet.time_correction(timeout=self.clock_timeout)
+            except (TimeoutError, LostError):
+                continue
+            self.writer.write_clock_offset(stream_id, local_clock(), offset)
+
+    def stop(self, timeout = 10):
+        '''Write the remaining chunks, close the file and wait for the thread to finish.
+
+        Waits at most timeout seconds for the queued chunks to be written, so stopping never
+        hangs on a full queue.
+        '''
+        if self.is_alive():
+            try:
+                self.queue.put(None, timeout=timeout)
+            except Full:
+                raise(RuntimeError('Recording to ' + self.filename + ' did not finish: the writer is blocked.'))
+            self.join(timeout)
+            if self.is_alive():
+                raise(RuntimeError('Recording to ' + self.filename + ' did not finish writing in ' + str(timeout) + ' seconds.'))
+        if self.error is not None:
+            raise(RuntimeError('Recording to ' + self.filename + ' failed: ' + str(self.error)))
+
+def record_streams(inlets, filename, duration = None, max_chunks = 256):
+    '''Record LSL streams to an XDF file without showing them.
+
+    Args:
+        inlets : array
+            LSL streams captured.
+        filename : string
+            Full path of the XDF file to create. It can be imported with read_raw_xdf.
+        duration : float
+            Seconds recorded. Until interrupted (Ctrl+C) if not specified.
+        max_chunks : int
+            Maximum number of chunks waiting to be written.
+    See also:
+        search_streams
+        start_streaming
+    '''
+    recorder = StreamRecorder(filename, inlets, max_chunks=max_chunks)
+    # Samples are only written to disk, the buffers keep the latest one
+    readers = [StreamReader(inlet, RingBuffer(1, inlet.info().channel_count()), recorder=recorder, stream_id=stream_id) for stream_id, inlet in enumerate(inlets)]
+
+    recorder.start()
+    for reader in readers:
+        reader.start()
+
+    report('Recording to: ', filename)
+    try:
+        start = monotonic()
+        while duration is None or monotonic() - start < duration:
+            sleep(0.1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for reader in readers:
+            reader.stop()
+        recorder.stop()
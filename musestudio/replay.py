@@ -0,0 +1,164 @@
+import numpy as np
+from .import_raw_files import iter_raw_xdf_dir, read_raw_xdf
+from .instrumentation import report
+from os import path
+from pylsl import StreamInfo, StreamOutlet, local_clock
+from time import sleep
+
+def replay_xdf(filename = None, speed = 1, n_devices = 1, loop = False, chunk_duration = 0.05, stream_types = None, wait = 0):
+    '''Publish recordings in XDF format as LSL streams, as if the Muse devices were connected.
+
+    Every stream is published with the name, type, sampling rate, format and description
+    (e.g. channel labels) of the recording, so it can be found with search_streams and
+    shown with start_streaming. Timestamps keep the intervals between the original
+    samples, divided by the speed.
+
+    Args:
+        filename : string
+            Full path to a recording, or to a directory with recordings that are replayed at the same time.
+        speed : float
+            Replay speed: 1 replays in real time and 2 twice as fast. Use None to publish
+            all the samples as fast as possible.
+        n_devices : int
+            Number of simulated devices publishing every recording, e.g. to test the load of many headsets.
+            Copies are named Muse-R001, Muse-R002... instead of the original devices, with a
+            different name for every copy of every device.
+        loop : bool
+            Start again when the recordings end, until interrupted (Ctrl+C).
+        chunk_duration : float
+            Seconds of recording published at once.
+        stream_types : array
+            Types of streams to publish: 'EEG', 'Accelerometer', 'PPG' or 'Gyroscope'. All if not specified.
+        wait : float
+            Maximum seconds waiting for every stream to have a consumer before starting.
+    Returns:
+        Dictionary with the samples published, the seconds replayed and the maximum delay of
+        a chunk in seconds from the time it should have been published.
+    Raises:
+        ValueError: if filename is not specified, speed is not positive or n_devices is lower than 1.
+    See also:
+        read_raw_xdf
+        search_streams
+    '''
+    if filename is None:
+        raise(ValueError('Enter the path of a recording or a directory with recordings.'))
+
+    if speed is not None and speed <= 0:
+        raise(ValueError('speed must be a positive number or None.'))
+
+    if n_devices < 1:
+        raise(ValueError('n_devices must be at least 1.'))
+
+    # Recordings of a directory start at the same time, whenever they were recorded
+    if path.isdir(filename):
+        bundles = list(iter_raw_xdf_dir(filename, stream_types=stream_types))
+    else:
+        bundles = [read_raw_xdf(filename, stream_types=stream_types)]
+
+    streams, duration = [], 0
+    for bundle in bundles:
+        bundle_streams = [stream for streams_type in bundle[:4] for stream in streams_type if len(stream['time_stamps']) > 0]
+        if len(bundle_streams) > 0:
+            first = min(stream['time_stamps'][0] for stream in bundle_streams)
+            duration = max(duration, max(stream['time_stamps'][-1] for stream in bundle_streams) - first)
+            streams.extend((stream, first) for stream in bundle_streams)
+
+    if len(streams) == 0:
+        raise(RuntimeError('No streams found in ' + filename + '.'))
+
+    # Streams of the same device keep the same name in every copy
+    devices = {}
+    for stream, first in streams:
+        devices.setdefault(stream['info']['name'][0][:9], len(devices))
+
+    outlets = [(create_outlet(stream, copy, devices), stream, first) for copy in range(n_devices) for stream, first in streams]
+    for outlet, stream, first in outlets:
+        outlet.wait_for_consumers(wait)
+
+    report('Replaying ' + str(len(outlets)) + ' streams')
+
+    summary = {'samples': 0, 'seconds': 0, 'max_delay': 0}
+    try:
+        while True:
+            replay_once(outlets, duration, speed, chunk_duration, summary)
+            if not loop:
+                break
+    except KeyboardInterrupt:
+        pass
+
+    return summary
+
+def replay_once(outlets, duration, speed, chunk_duration, summary):
+    '''Publish the recordings once, chunk by chunk.'''
+    start = local_clock()
+    # Position of every stream in its recording
+    positions = [0 for outlet in outlets]
+
+    # Seconds from the start of the recordings
+    for chunk_end in np.arange(chunk_duration, duration + 2 * chunk_duration, chunk_duration):
+        if speed is not None:
+            publish_time = start + chunk_end / speed
+            now = local_clock()
+            if publish_time > now:
+                sleep(publish_time - now)
+            else:
+                summary['max_delay'] = max(summary['max_delay'], now - publish_time)
+
+        for index, (outlet, stream, first) in enumerate(outlets):
+            end = np.searchsorted(stream['time_stamps'], first + chunk_end, side='right')
+            if end > positions[index]:
+                timestamps = (stream['time_stamps'][positions[index]:end] - first) / (speed or 1) + start
+                outlet.push_chunk(stream['time_series'][positions[index]:end], timestamps.tolist())
+                summary['samples'] += int(end - positions[index])
+                positions[index] = end
+
+    summary['seconds'] += local_clock() - start
+
+def create_outlet(stream, copy = 0, devices = None):
+    '''Create an LSL outlet with the metadata of a stream of a recording.
+
+    Copies are renamed after the number of the original device in devices, a dictionary
+    from device names to their position, so copies of different devices never share a name.
+    '''
+    info = stream['info']
+    name = info['name'][0]
+    source_id = info['source_id'][0] if info.get('source_id') and info['source_id'][0] else name
+
+    if copy > 0:
+        devices = {name[:9]: 0} if devices is None else devices
+        name = 'Muse-R%03d' % (copy * len(devices) + devices[name[:9]]) + name[9:]
+        source_id = source_id + '-replay' + str(copy)
+
+    outlet_info = StreamInfo(
+        name,
+        info['type'][0],
+        int(info['channel_count'][0]),
+        float(info['nominal_srate'][0]),
+        info['channel_format'][0],
+        source_id
+    )
+    if info.get('desc') and info['desc'][0]:
+        append_desc(outlet_info.desc(), info['desc'][0])
+
+    return StreamOutlet(outlet_info)
+
+def append_desc(element, desc):
+    '''Copy the description of a stream, as decoded by pyxdf, into an LSL description element.'''
+    for key, values in desc.items():
+        for value in values:
+            if isinstance(value, dict):
+                append_desc(element.append_child(key), value)
+            else:
+                element.append_child_value(key, value if value is not None else '')
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description='Publish Muse recordings in XDF format as LSL streams.')
+    parser.add_argument('filename', help='recording or directory with recordings')
+    parser.add_argument('--speed', type=float, default=1, help='replay speed, 0 for as fast as possible')
+    parser.add_argument('--devices', type=int, default=1, help='number of simulated devices')
+    parser.add_argument('--loop', action='store_true', help='replay until interrupted')
+    args = parser.parse_args()
+
+    print(replay_xdf(args.filename, speed=args.speed or None, n_devices=args.devices, loop=args.loop))
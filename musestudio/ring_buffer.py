@@ -0,0 +1,72 @@
+import numpy as np
+
+class RingBuffer:
+    '''Fixed-size buffer with the latest samples and timestamps of a stream.
+
+    Every sample is stored twice, in both halves of an array of twice the capacity,
+    so the latest samples are always contiguous and can be read as a view without
+    copying. Appending costs O(new samples) however long the stream runs.
+
+    Args:
+        capacity : int
+            Maximum number of samples kept.
+        n_channels : int
+            Number of channels of the stream.
+        dtype : numpy dtype
+            Type of the samples.
+    '''
+    def __init__(self, capacity, n_channels, dtype = np.float64):
+        if capacity < 1:
+            raise(ValueError('Ring buffer capacity must be at least 1 sample.'))
+
+        self.capacity = int(capacity)
+        self.data = np.zeros((2 * self.capacity, n_channels), dtype=dtype)
+        self.timestamps = np.zeros(2 * self.capacity, dtype=np.float64)
+        # Total number of samples appended since the buffer was created
+        self.count = 0
+
+    def append(self, samples, timestamps):
+        '''Add a chunk of samples, dropping the oldest ones when the buffer is full.
+
+        Args:
+            samples : array, shape(n_samples, n_channels)
+                Samples of the chunk.
+            timestamps : array, shape(n_samples,)
+                Timestamps of the samples.
+        '''
+        n_samples = len(timestamps)
+        if n_samples == 0:
+            return
+
+        # Only the last samples of chunks larger than the buffer are kept
+        kept = min(n_samples, self.capacity)
+        samples = np.asarray(samples)[-kept:]
+        timestamps = np.asarray(timestamps)[-kept:]
+
+        positions = (self.count + (n_samples - kept) + np.arange(kept)) % self.capacity
+        self.data[positions] = samples
+        self.data[positions + self.capacity] = samples
+        self.timestamps[positions] = timestamps
+        self.timestamps[positions + self.capacity] = timestamps
+        self.count += n_samples
+
+    def __len__(self):
+        '''Number of samples available in the buffer.'''
+        return min(self.count, self.capacity)
+
+    def latest(self, n_samples):
+        '''Get the latest samples as read-only views of the buffer.
+
+        Args:
+            n_samples : int
+                Number of samples. Limited to the samples available.
+        Returns:
+            Two arrays: samples with shape (n, n_channels) and timestamps with shape (n,), oldest first.
+        '''
+        n_samples = max(0, min(int(n_samples), len(self)))
+        end = (self.count - 1) % self.capacity + self.capacity + 1 if self.count > 0 else self.capacity
+        data = self.data[end - n_samples:end]
+        timestamps = self.timestamps[end - n_samples:end]
+        data.flags.writeable = False
+        timestamps.flags.writeable = False
+        return data, timestamps
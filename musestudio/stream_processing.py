@@ -0,0 +1,120 @@
+import numpy as np
+from collections import deque
+from scipy.signal import butter, iirnotch, sosfilt, tf2sos
+
+class StreamProcessor:
+    '''Filters and quality metrics applied to a stream while it is acquired.
+
+    Every chunk is filtered with IIR filters whose state is carried to the next chunk,
+    so the output is the same as filtering the whole recording at once with
+    scipy.signal.sosfilt. The range of every channel over the latest samples is
+    updated with every chunk, at a cost proportional to the new samples.
+
+    Args:
+        sfreq : float
+            Sampling frequency of the stream.
+        n_channels : int
+            Number of channels of the stream.
+        notch : float
+            Line frequency removed with a notch filter, 50 or 60 Hz. Not filtered if not specified.
+        l_freq : float
+            Low cut-off frequency of the band-pass filter. High-pass only if h_freq is not specified.
+        h_freq : float
+            High cut-off frequency of the band-pass filter. Low-pass only if l_freq is not specified.
+        order : int
+            Order of the band-pass filter.
+        quality_window : int
+            Number of latest samples used in the quality metrics.
+    Raises:
+        ValueError: if a cut-off frequency is not below the Nyquist frequency.
+    '''
+    def __init__(self, sfreq, n_channels, notch = None, l_freq = None, h_freq = None, order = 4, quality_window = 200):
+        self.sos = filter_sos(sfreq, notch, l_freq, h_freq, order)
+        # Filter state of every second-order section and channel, initially at rest
+        self.zi = np.zeros((len(self.sos), 2, n_channels)) if self.sos is not None else None
+        self.quality = RollingRange(quality_window, n_channels)
+
+    def process(self, samples):
+        '''Filter a chunk of samples and update the quality metrics.
+
+        Args:
+            samples : array, shape(n_samples, n_channels)
+                Samples of the chunk.
+        Returns:
+            Filtered samples, with the same shape.
+        '''
+        samples = np.asarray(samples, dtype=np.float64)
+        if self.sos is not None and len(samples) > 0:
+            samples, self.zi = sosfilt(self.sos, samples, axis=0, zi=self.zi)
+        self.quality.update(samples)
+        return samples
+
+def filter_sos(sfreq, notch = None, l_freq = None, h_freq = None, order = 4):
+    '''Second-order sections of the notch and band-pass filters. None if there are no filters.'''
+    nyquist = sfreq / 2
+    for freq in [notch, l_freq, h_freq]:
+        if freq is not None and not 0 < freq < nyquist:
+            raise(ValueError('Filter frequencies must be between 0 and ' + str(nyquist) + ' Hz.'))
+
+    sections = []
+    if notch is not None:
+        sections.append(tf2sos(*iirnotch(notch, 30, fs=sfreq)))
+    if l_freq is not None and h_freq is not None:
+        sections.append(butter(order, [l_freq, h_freq], btype='bandpass', output='sos', fs=sfreq))
+    elif l_freq is not None:
+        sections.append(butter(order, l_freq, btype='highpass', output='sos', fs=sfreq))
+    elif h_freq is not None:
+        sections.append(butter(order, h_freq, btype='lowpass', output='sos', fs=sfreq))
+
+    return np.concatenate(sections) if len(sections) > 0 else None
+
+class RollingRange:
+    '''Maximum and minimum of every channel over the latest samples of a stream.
+
+    Candidates for the maximum and minimum are kept in monotonic queues, so every new
+    sample costs amortized constant time whatever the size of the window.
+
+    Args:
+        window : int
+            Number of latest samples.
+        n_channels : int
+            Number of channels of the stream.
+    '''
+    def __init__(self, window, n_channels):
+        self.window = window
+        # Total number of samples seen
+        self.count = 0
+        # Pairs of sample number and value, per channel
+        self.maxima = [deque() for channel in range(n_channels)]
+        self.minima = [deque() for channel in range(n_channels)]
+
+    def update(self, samples):
+        '''Add a chunk of samples, with shape (n_samples, n_channels).'''
+        samples = np.asarray(samples)
+        if len(samples) == 0:
+            return
+
+        # Only the latest samples of chunks larger than the window can be in it
+        skipped = max(0, len(samples) - self.window)
+        first = self.count + skipped
+        oldest = self.count + len(samples) - self.window
+
+        for channel, (maxima, minima) in enumerate(zip(self.maxima, self.minima)):
+            for number, value in enumerate(samples[skipped:, channel].tolist(), start=first):
+                while maxima and maxima[-1][1] <= value:
+                    maxima.pop()
+                maxima.append((number, value))
+                while minima and minima[-1][1] >= value:
+                    minima.pop()
+                minima.append((number, value))
+
+            while maxima[0][0] < oldest:
+                maxima.popleft()
+            while minima[0][0] < oldest:
+                minima.popleft()
+
+        self.count += len(samples)
+
+    def ranges(self):
+        '''Difference between the maximum and minimum of every channel. NaN before the first sample.'''
+        return np.array([maxima[0][1] - minima[0][1] if maxima else np.nan for maxima, minima in zip(self.maxima, self.minima)])
@@ -1,30 +1,41 @@
-import pandas as pd
-from dash import Dash, callback_context, dcc, html
-from dash.dependencies import Input, Output
+import numpy as np
+from .acquisition import StreamReader
+from .instrumentation import Stage, report
+from .recorder import StreamRecorder
+from .ring_buffer import RingBuffer
+from .stream_processing import StreamProcessor
+from dash import Dash, callback_context, dcc, html, no_update
+from dash.dependencies import ALL, Input, Output, State
 from dash_daq import BooleanSwitch
-from datetime import datetime, timezone
+from datetime import datetime
+from dateutil.tz import tzlocal
 from plotly.graph_objects import Scatter
 from plotly.subplots import make_subplots
 from pylsl import StreamInlet, resolve_byprop
 
+GRAPH_CONFIG = {
+    'displaylogo': False,
+    'modeBarButtonsToRemove': ['pan2d','lasso2d']
+}
+
 def search_streams():
     '''Look for EEG streams using LSL protocol.
 
     Returns:
         Array of LSL streams.
     '''
-    print("Searching streams")
+    report("Searching streams")
     streams = resolve_byprop('type', 'EEG')
 
     inlets = []
     for stream in streams:
         inlet = StreamInlet(stream)
         inlets.append(inlet)
-        print('Stream found: ', inlet.info().source_id())
+        report('Stream found: ', inlet.info().source_id())
 
     return inlets
 
-def start_streaming(inlets, channels = ['TP9', 'AF7', 'AF8', 'TP10'], debug = False):
+def start_streaming(inlets, channels = ['TP9', 'AF7', 'AF8', 'TP10'], debug = False, retention = 60, max_points = 1000, incremental = False, record = None, notch = None, l_freq = None, h_freq = None):
     '''Convert recordings to MNE format.
 
     Args:
@@ -34,13 +45,35 @@ def start_streaming(inlets, channels = ['TP9', 'AF7', 'AF8', 'TP10'], debug = Fa
             Channels to draw in graphs.
         debug : bool
             Dash debugging.
+        retention : float
+            Seconds of data kept in memory for every stream. Older samples are dropped.
+        max_points : int
+            Maximum number of points sent per trace, about the width of a graph in pixels.
+            Longer windows are reduced to the minimum and maximum of every group of samples.
+        incremental : bool
+            Create the graphs once and then send only the new samples on every update,
+            instead of rebuilding the whole figures. Graphs are rebuilt when the controls change.
+            Samples are never reduced in this mode, so at most max_points samples are shown.
+        record : string
+            Full path of an XDF file where the streams are recorded while they are shown.
+            The file can be imported with read_raw_xdf. Not recorded if not specified.
+            Samples are recorded as acquired, without filters.
+        notch : float
+            Line frequency removed from the streams shown, 50 or 60 Hz. Not filtered if not specified.
+        l_freq : float
+            Low cut-off frequency of the band-pass filter applied to the streams shown.
+        h_freq : float
+            High cut-off frequency of the band-pass filter applied to the streams shown.
     See also:
         search_streams
     '''
-    global df, data_shown, playpause, expand_graphs
+    global readers, snapshots, qualities, data_shown, playpause, expand_graphs
 
     cols = []
-    df = []
+    names = []
+    readers = []
+    # Display and recording share the same inlets
+    recorder = StreamRecorder(record, inlets) if record is not None else None
 
     for inlet in inlets:
         channel = inlet.info().desc().child('channels').first_child()
@@ -51,7 +84,18 @@ def start_streaming(inlets, channels = ['TP9', 'AF7', 'AF8', 'TP10'], debug = Fa
             all_channels.append(channel.child_value('label'))
 
         cols.append(all_channels)
-        df.append(pd.DataFrame(columns=all_channels))
+        names.append(inlet.info().name())
+        # Streams without a nominal rate are buffered as if they were sampled at 256 Hz
+        srate = inlet.info().nominal_srate() or 256
+        # Every inlet is drained by its own thread, independently of the graphs
+        # Filters and channel quality are updated as samples arrive
+        processor = StreamProcessor(srate, len(all_channels), notch, l_freq, h_freq)
+        readers.append(StreamReader(inlet, RingBuffer(int(retention * srate), len(all_channels)), recorder=recorder, stream_id=len(readers), processor=processor))
+
+    snapshots = [reader.snapshot(0) for reader in readers]
+    qualities = [reader.quality() for reader in readers]
+    # Number of samples of every stream already sent to the graphs in incremental mode
+    sent = [0 for reader in readers]
 
     data_shown = 1400
     playpause = True
@@ -59,115 +103,264 @@ def start_streaming(inlets, channels = ['TP9', 'AF7', 'AF8', 'TP10'], debug = Fa
 
     app = Dash(__name__)
     app.title = 'Muse streaming'
-    app.layout = serve_layout(channels)
+    app.layout = serve_layout(channels, names if incremental else None)
 
-    @app.callback(
-        Output('interval_component', 'interval'),
-        Input('interval_modifier', 'value')
-    )
-    def update_interval(value):
-        return value
-
-    @app.callback(
-        Output('graphs', 'children'),
-        Input('interval_component', 'n_intervals'),
-        Input('channels_selected', 'value'),
-        Input('zoom_in', 'n_clicks'),
-        Input('zoom_out', 'n_clicks'),
-        Input('reset', 'n_clicks'),
-        Input('playstop', 'n_clicks'),
-        Input('expand_graphs', 'on')
-    )
-    def draw_graph(in_interval, in_channels_selected, in_zoom_in, in_zoom_out, in_reset, in_playstop, in_expand_graphs):
-        global df, data_shown, playpause, expand_graphs
-
-        changed_id = [p['prop_id'] for p in callback_context.triggered][0]
+    def update_controls(changed_id):
+        global data_shown, playpause
 
         if 'zoom_in' in changed_id:
             if data_shown != 200:
                 data_shown = data_shown - 200
         if 'zoom_out' in changed_id:
-            data_shown = data_shown + 200
+            if data_shown + 200 <= max(reader.buffer.capacity for reader in readers):
+                data_shown = data_shown + 200
         if 'reset' in changed_id:
             data_shown = 1400
         if 'playstop' in changed_id:
             playpause = True if playpause == False else False
 
-        graphs = []
-        for index, inlet in enumerate(inlets):
-            if playpause == True:
-                samples, timestamps = inlet.pull_chunk(timeout=0.0, max_samples=1024)
-                utc = [datetime.utcfromtimestamp(timestamp).replace(tzinfo=timezone.utc).astimezone(tz=None).strftime('%H:%M:%S.%f') for index, timestamp in enumerate(timestamps)]
-
-                df_aux = pd.DataFrame(samples, columns=cols[index], index=utc)
-                df[index] = df[index].append(df_aux)
-                df_to_show = df[index].tail(data_shown)
-                df_to_show = df_to_show[in_channels_selected]
-            else:
-                df_to_show = df[index].tail(data_shown)
-                df_to_show = df_to_show[in_channels_selected]
-
-            channel_qualities = []
-            for i in in_channels_selected:
-                if abs(df_to_show[i].tail(200).max() - df_to_show[i].tail(200).min()) < 300:
-                    channel_qualities.append(i + ' - GOOD ' + u'\u2713')
-                else:
-                    channel_qualities.append(i + ' - BAD ' + u'\u2716')
-
-            if in_expand_graphs == False:
-                if len(df_to_show.columns) % 2 == 0:
-                    fig = make_subplots(rows=int(len(df_to_show.columns) / 2), cols=2, subplot_titles=channel_qualities)
-                else:
-                    fig = make_subplots(rows=int((len(df_to_show.columns) / 2) + 0.5), cols=2, subplot_titles=channel_qualities)
-                
-                j = [1, 1, 2, 2, 3]
-                k = [1, 2, 1, 2, 1]
-                for index2, column in enumerate(df_to_show.columns):
-                    fig.add_trace(
-                        Scatter({
-                            'x': df_to_show.index,
-                            'y': df_to_show[column]
-                        }),
-                        row=j[index2],
-                        col=k[index2]
-                    )
-                heights = [500, 500, 800, 800, 1100]
-                fig.update_layout(height=heights[len(df_to_show.columns)-1], showlegend=False)
-            else:
-                fig = make_subplots(rows=len(df_to_show.columns), cols=1, subplot_titles=channel_qualities)
-                j = 1
-                for i in df_to_show.columns:
-                    fig.add_trace(
-                        Scatter({
-                            'x': df_to_show.index,
-                            'y': df_to_show[i]
-                        }),
-                        row=j,
-                        col=1
-                    )
-                    j += 1
-                heights = [500, 900, 1200, 1500, 1600]
-                fig.update_layout(height=heights[len(df_to_show.columns)-1], showlegend=False)
-
-            graphs.append(
-                html.Div([
-                    html.H3(inlet.info().name()),
-                    dcc.Graph(
-                        id='muse_livestream',
-                        config={
-                            'displaylogo': False,
-                            'modeBarButtonsToRemove': ['pan2d','lasso2d']
-                        },
-                        figure=fig
-                    )
-                ], style={'margin': 'auto', 'text-align': 'center'})
+    def samples_shown():
+        # Graphs extended with every new sample cannot be decimated consistently
+        return min(data_shown, max_points) if incremental and max_points is not None else data_shown
+
+    def select_channels(index, data, in_channels_selected):
+        return [(channel, data[:, cols[index].index(channel)]) for channel in in_channels_selected if channel in cols[index]]
+
+    def select_ranges(index, ranges, in_channels_selected):
+        return [ranges[cols[index].index(channel)] for channel in in_channels_selected if channel in cols[index]]
+
+    @app.callback(
+        Output('interval_component', 'interval'),
+        Input('interval_modifier', 'value')
+    )
+    def update_interval(value):
+        return value
+
+    if not incremental:
+        @app.callback(
+            Output('graphs', 'children'),
+            Input('interval_component', 'n_intervals'),
+            Input('channels_selected', 'value'),
+            Input('zoom_in', 'n_clicks'),
+            Input('zoom_out', 'n_clicks'),
+            Input('reset', 'n_clicks'),
+            Input('playstop', 'n_clicks'),
+            Input('expand_graphs', 'on')
+        )
+        def draw_graph(in_interval, in_channels_selected, in_zoom_in, in_zoom_out, in_reset, in_playstop, in_expand_graphs):
+            changed_id = [p['prop_id'] for p in callback_context.triggered][0]
+            update_controls(changed_id)
+
+            graphs = []
+            for index, reader in enumerate(readers):
+                # While paused, the last snapshot is shown and acquisition goes on in the background
+                if playpause == True or 'zoom' in changed_id or 'reset' in changed_id:
+                    snapshots[index] = reader.snapshot(data_shown)
+                    qualities[index] = reader.quality()
+
+                data, timestamps = snapshots[index]
+                with Stage('view_update', names[index], samples=len(timestamps)):
+                    fig = build_figure(timestamps, select_channels(index, data, in_channels_selected), in_expand_graphs, max_points, select_ranges(index, qualities[index], in_channels_selected))
+
+                graphs.append(
+                    html.Div([
+                        html.H3(names[index]),
+                        dcc.Graph(
+                            id='muse_livestream',
+                            config=GRAPH_CONFIG,
+                            figure=fig
+                        )
+                    ], style={'margin': 'auto', 'text-align': 'center'})
+                )
+
+            return(html.Div(graphs))
+    else:
+        @app.callback(
+            Output({'type': 'muse_livestream', 'index': ALL}, 'figure'),
+            Input('channels_selected', 'value'),
+            Input('zoom_in', 'n_clicks'),
+            Input('zoom_out', 'n_clicks'),
+            Input('reset', 'n_clicks'),
+            Input('playstop', 'n_clicks'),
+            Input('expand_graphs', 'on')
+        )
+        def draw_layout(in_channels_selected, in_zoom_in, in_zoom_out, in_reset, in_playstop, in_expand_graphs):
+            changed_id = [p['prop_id'] for p in callback_context.triggered][0]
+            update_controls(changed_id)
+
+            figures = []
+            for index, reader in enumerate(readers):
+                data, timestamps, sent[index] = reader.read_since(reader.buffer.count - samples_shown())
+                with Stage('view_update', names[index], samples=len(timestamps)):
+                    figures.append(build_figure(timestamps, select_channels(index, data, in_channels_selected), in_expand_graphs, None, select_ranges(index, reader.quality(), in_channels_selected)))
+
+            return figures
+
+        @app.callback(
+            Output({'type': 'muse_livestream', 'index': ALL}, 'extendData'),
+            Output({'type': 'muse_quality', 'index': ALL}, 'children'),
+            Input('interval_component', 'n_intervals'),
+            State('channels_selected', 'value'),
+            prevent_initial_call=True
+        )
+        def extend_graph(in_interval, in_channels_selected):
+            if playpause == False:
+                return [no_update] * len(readers), [no_update] * len(readers)
+
+            extensions, labels = [], []
+            for index, reader in enumerate(readers):
+                # Only the samples acquired since the previous update are sent
+                data, timestamps, sent[index] = reader.read_since(sent[index])
+                with Stage('view_update', names[index], samples=len(timestamps)):
+                    selected = select_channels(index, data, in_channels_selected)
+                    local_time = to_local_milliseconds(timestamps)
+                    extensions.append((
+                        {'x': [local_time for channel, samples in selected], 'y': [samples for channel, samples in selected]},
+                        list(range(len(selected))),
+                        samples_shown()
+                    ))
+
+                    selected_ranges = select_ranges(index, reader.quality(), in_channels_selected)
+                    labels.append(' | '.join(channel_quality(channel, value_range) for (channel, samples), value_range in zip(selected, selected_ranges)))
+
+            return extensions, labels
+
+    if recorder is not None:
+        recorder.start()
+    for reader in readers:
+        reader.start()
+
+    try:
+        # Dash 2.x provides run_server and newer versions run
+        (app.run if hasattr(app, 'run') else app.run_server)(debug=debug)
+    finally:
+        for reader in readers:
+            reader.stop()
+        if recorder is not None:
+            recorder.stop()
+
+def build_figure(timestamps, selected, expand_graphs = False, max_points = None, ranges = None):
+    '''Build the figure of a stream with one graph per selected channel.
+
+    Args:
+        timestamps : array
+            LSL timestamps of the samples shown.
+        selected : array
+            Pairs of channel name and samples of the channel.
+        expand_graphs : bool
+            Draw one graph per row instead of two.
+        max_points : int
+            Maximum number of points per trace. All samples are drawn if not specified.
+        ranges : array
+            Range of every selected channel over its latest samples, used for the quality labels.
+            Computed from the latest 200 samples if not specified.
+    Returns:
+        Plotly figure.
+    '''
+    # Local time in milliseconds, drawn on date axes, instead of formatted strings
+    local_time = to_local_milliseconds(timestamps)
+
+    if ranges is None:
+        ranges = [np.ptp(samples[-200:]) if len(samples) > 0 else np.nan for channel, samples in selected]
+    channel_qualities = [channel_quality(channel, value_range) for (channel, samples), value_range in zip(selected, ranges)]
+
+    if expand_graphs == False:
+        fig = make_subplots(rows=max(1, int((len(selected) / 2) + 0.5)), cols=2, subplot_titles=channel_qualities)
+        
+        j = [1, 1, 2, 2, 3]
+        k = [1, 2, 1, 2, 1]
+        for index, (channel, samples) in enumerate(selected):
+            x, y = decimate_minmax(local_time, samples, max_points)
+            fig.add_trace(
+                Scatter({
+                    'x': x,
+                    'y': y
+                }),
+                row=j[index],
+                col=k[index]
+            )
+        heights = [500, 500, 800, 800, 1100]
+        fig.update_layout(height=heights[max(len(selected), 1)-1], showlegend=False)
+    else:
+        fig = make_subplots(rows=max(1, len(selected)), cols=1, subplot_titles=channel_qualities)
+        for index, (channel, samples) in enumerate(selected):
+            x, y = decimate_minmax(local_time, samples, max_points)
+            fig.add_trace(
+                Scatter({
+                    'x': x,
+                    'y': y
+                }),
+                row=index + 1,
+                col=1
             )
+        heights = [500, 900, 1200, 1500, 1600]
+        fig.update_layout(height=heights[max(len(selected), 1)-1], showlegend=False)
 
-        return(html.Div(graphs))
+    fig.update_xaxes(type='date', tickformat='%H:%M:%S.%L')
 
-    app.run_server(debug=debug)
+    return fig
+
+def channel_quality(channel, value_range):
+    '''Label a channel as good when its latest samples span less than 300 microvolts.'''
+    if abs(value_range) < 300:
+        return channel + ' - GOOD ' + u'\u2713'
+    return channel + ' - BAD ' + u'\u2716'
+
+def to_local_milliseconds(timestamps):
+    '''Convert timestamps in seconds to milliseconds in local time, as expected by date axes.'''
+    offset = tzlocal().utcoffset(datetime.now()).total_seconds()
+    return (np.asarray(timestamps) + offset) * 1000
+
+def decimate_minmax(x, y, max_points = None):
+    '''Reduce a trace to the minimum and maximum of consecutive groups of samples.
+
+    The envelope keeps the peaks of the signal, so zoomed out views look the same
+    as drawing every sample, while sending at most max_points points.
+
+    Args:
+        x : array
+            Horizontal values of the trace.
+        y : array
+            Vertical values of the trace.
+        max_points : int
+            Maximum number of points. No reduction if not specified.
+    Returns:
+        The reduced x and y arrays.
+    '''
+    n_samples = len(y)
+    if max_points is None or n_samples <= max_points or max_points < 2:
+        return x, y
+
+    # Groups of the same size. The oldest samples that do not fill a group are left out.
+    group_size = int(np.ceil(n_samples / (max_points // 2)))
+    n_groups = n_samples // group_size
+    start = n_samples - n_groups * group_size
+    groups = np.asarray(y)[start:].reshape(n_groups, group_size)
+
+    # Position of the minimum and maximum of every group, in time order
+    offsets = np.arange(n_groups)[:, None] * group_size + start
+    positions = np.sort(np.stack([groups.argmin(axis=1), groups.argmax(axis=1)], axis=1), axis=1) + offsets
+    positions = positions.ravel()
+
+    return np.asarray(x)[positions], np.asarray(y)[positions]
+
+def serve_layout(channels, names = None):
+    # In incremental mode the graphs are created once, one per stream
+    if names is not None:
+        graphs = html.Div([
+            html.Div([
+                html.H3(name),
+                html.P(id={'type': 'muse_quality', 'index': index}),
+                dcc.Graph(
+                    id={'type': 'muse_livestream', 'index': index},
+                    config=GRAPH_CONFIG
+                )
+            ], style={'margin': 'auto', 'text-align': 'center'})
+            for index, name in enumerate(names)
+        ], id='graphs')
+    else:
+        graphs = html.Div(id='graphs')
 
-def serve_layout(channels):
     return html.Div([
         html.Div([
             html.H1('Muse streaming'),
@@ -224,5 +417,5 @@ def serve_layout(channels):
 
         ], style={'margin': 'auto', 'text-align': 'center'}),
 
-        html.Div(id='graphs')
+        graphs
     ])
@@ -0,0 +1,120 @@
+import numpy as np
+import pickle
+from hashlib import sha1
+from os import listdir, makedirs, path, rename, stat, utime
+from shutil import rmtree
+from tempfile import mkdtemp
+
+ARRAY_FIELDS = ['time_series', 'time_stamps']
+
+def load_cached(filename, loader, cache_dir, cache_size = None, key_extra = ''):
+    '''Load an XDF file through an on-disk cache of decoded streams.
+
+    Decoded arrays are stored as NumPy files and opened as copy-on-write memory maps,
+    so repeated loads skip the XDF decoding. Entries are keyed by path, size and
+    modification time, and the least recently used ones are evicted when the cache
+    grows over cache_size.
+
+    Args:
+        filename : string
+            full path to a single recording
+        loader : function
+            Function that decodes the file when it is not cached. Must return the same
+            (streams, header) tuple as pyxdf.load_xdf.
+        cache_dir : string
+            Directory used to store the cache.
+        cache_size : int
+            Maximum size of the cache in bytes. No limit if not specified.
+        key_extra : string
+            Additional text added to the key, e.g. to tell apart partial loads.
+    Returns:
+        The (streams, header) tuple returned by loader.
+    '''
+    makedirs(cache_dir, exist_ok=True)
+    entry = path.join(cache_dir, cache_key(filename, key_extra))
+
+    if path.exists(path.join(entry, 'meta.pkl')):
+        try:
+            data = read_entry(entry)
+            # Mark the entry as recently used
+            utime(path.join(entry, 'meta.pkl'))
+            return data
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            rmtree(entry, ignore_errors=True)
+
+    data = loader(filename)
+    write_entry(entry, cache_dir, data)
+
+    if cache_size is not None:
+        evict(cache_dir, cache_size, keep=entry)
+
+    return data
+
+def cache_key(filename, key_extra = ''):
+    '''Build the key of a file from its path, size and modification time.'''
+    file_stat = stat(filename)
+    key = '|'.join([path.abspath(filename), str(file_stat.st_size), str(file_stat.st_mtime_ns), key_extra])
+    return sha1(key.encode('utf-8')).hexdigest()
+
+def read_entry(entry):
+    '''Read a cache entry, opening the stored arrays as memory maps.'''
+    with open(path.join(entry, 'meta.pkl'), 'rb') as f:
+        streams, header = pickle.load(f)
+
+    for index, stream in enumerate(streams):
+        for field in ARRAY_FIELDS:
+            if stream.get(field) is None:
+                stream[field] = np.load(path.join(entry, str(index) + '_' + field + '.npy'), mmap_mode='c')
+
+    return streams, header
+
+def write_entry(entry, cache_dir, data):
+    '''Write a cache entry atomically. Numeric arrays are stored as NumPy files.'''
+    streams, header = data
+    tmp_entry = mkdtemp(dir=cache_dir, prefix='.tmp_')
+
+    try:
+        meta = []
+        for index, stream in enumerate(streams):
+            stream_meta = dict(stream)
+            for field in ARRAY_FIELDS:
+                value = stream.get(field)
+                # Empty arrays cannot be memory mapped and string streams are lists, keep them in the metadata
+                if isinstance(value, np.ndarray) and value.size > 0 and value.dtype != object:
+                    np.save(path.join(tmp_entry, str(index) + '_' + field + '.npy'), value)
+                    stream_meta[field] = None
+            meta.append(stream_meta)
+
+        with open(path.join(tmp_entry, 'meta.pkl'), 'wb') as f:
+            pickle.dump((meta, header), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        rename(tmp_entry, entry)
+    except OSError:
+        # Another process stored the same entry first
+        rmtree(tmp_entry, ignore_errors=True)
+
+def entry_size(entry):
+    '''Get the size in bytes of a cache entry.'''
+    return sum(path.getsize(path.join(entry, f)) for f in listdir(entry))
+
+def evict(cache_dir, cache_size, keep = None):
+    '''Remove the least recently used entries until the cache fits in cache_size bytes.'''
+    entries = []
+    for name in listdir(cache_dir):
+        entry = path.join(cache_dir, name)
+        meta = path.join(entry, 'meta.pkl')
+        if name.startswith('.') or not path.exists(meta):
+            continue
+        try:
+            entries.append((path.getmtime(meta), entry_size(entry), entry))
+        except OSError:
+            continue
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= cache_size:
+            break
+        if entry == keep:
+            continue
+        rmtree(entry, ignore_errors=True)
+        total -= size
@@ -19,8 +19,12 @@ setup(
         'plotly',
         'pybv',
         'pylsl',
-        'pyxdf'
+        'pyxdf',
+        'scipy'
     ],
+    extras_require={
+        'parquet': ['pyarrow']
+    },
     classifiers = [
         'Development Status :: 5 - Production/Stable',
         'Intended Audience :: Healthcare Industry',
@@ -0,0 +1,71 @@
+import gc
+import multiprocessing
+import os
+import weakref
+
+import numpy as np
+import pytest
+
+from musestudio import import_raw_files, iter_raw_xdf_dir
+from musestudio.recorder import XdfWriter
+
+HEADER = (
+    '<?xml version="1.0"?><info><name>Muse-AAAA</name><type>EEG</type><channel_count>4</channel_count>'
+    '<nominal_srate>256</nominal_srate><channel_format>float32</channel_format><source_id>Muse-AAAA</source_id></info>'
+)
+
+@pytest.fixture
+def recordings(tmp_path):
+    for index in range(3):
+        writer = XdfWriter(str(tmp_path / ('recording_%03d.xdf' % index)))
+        writer.add_stream(0, HEADER)
+        writer.write_samples(0, np.zeros((512, 4)), np.arange(512) / 256 + index)
+        writer.close()
+    return tmp_path
+
+@pytest.mark.parametrize('by_device', [False, True])
+def test_previous_file_is_released_before_parsing_the_next(recordings, monkeypatch, by_device):
+    load_data = import_raw_files.load_data
+    loaded, alive = [], []
+
+    def tracked_load_data(filename, **load_options):
+        gc.collect()
+        alive.append(sum(reference() is not None for reference in loaded))
+        streams_file = load_data(filename, **load_options)
+        loaded.extend(weakref.ref(stream['time_series']) for streams in streams_file for stream in streams)
+        return streams_file
+
+    monkeypatch.setattr(import_raw_files, 'load_data', tracked_load_data)
+
+    bundles = iter_raw_xdf_dir(str(recordings), by_device=by_device, incremental=True)
+    for bundle in bundles:
+        assert len(bundle[0]) == 1
+        del bundle
+
+    assert alive == [0, 0, 0]
+
+def test_failed_file_is_skipped_whatever_the_files_left(recordings):
+    list(iter_raw_xdf_dir(str(recordings), incremental=True))
+    (recordings / 'recording_003.xdf').write_bytes(b'not an xdf file')
+
+    # Only the broken file is left to parse in incremental mode
+    with pytest.warns(UserWarning, match='recording_003.xdf'):
+        assert list(iter_raw_xdf_dir(str(recordings), n_jobs=4, incremental=True)) == []
+
+    with pytest.warns(UserWarning, match='recording_003.xdf'):
+        assert len(list(iter_raw_xdf_dir(str(recordings), n_jobs=4))) == 3
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='workers must inherit the patched loader')
+def test_crashed_worker_does_not_abort_the_batch(recordings, monkeypatch):
+    load_data = import_raw_files.load_data
+
+    def crashing_load_data(filename, **load_options):
+        if filename.endswith('recording_001.xdf'):
+            os._exit(1)
+        return load_data(filename, **load_options)
+
+    monkeypatch.setattr(import_raw_files, 'load_data', crashing_load_data)
+
+    with pytest.warns(UserWarning, match='recording_001.xdf'):
+        bundles = list(iter_raw_xdf_dir(str(recordings), n_jobs=2))
+    assert [bundle[4] for bundle in bundles] == [['recording_000.xdf'], ['recording_002.xdf']]
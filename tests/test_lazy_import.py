@@ -0,0 +1,25 @@
+import json
+import subprocess
+import sys
+from os import path
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+HEAVY_MODULES = ['dash', 'dash_daq', 'plotly', 'pylsl', 'mne', 'mne_bids', 'pandas', 'scipy', 'pyarrow']
+
+def loaded_modules(code):
+    '''Run code in a new interpreter and get the heavy modules it loaded.'''
+    script = code + '\nimport json, sys\nprint(json.dumps([m for m in ' + repr(HEAVY_MODULES + ['pyxdf']) + ' if m in sys.modules]))'
+    output = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def test_import_loads_no_heavy_modules():
+    assert loaded_modules('import musestudio') == []
+
+def test_read_raw_xdf_loads_only_pyxdf():
+    assert loaded_modules('from musestudio import read_raw_xdf') == ['pyxdf']
+
+def test_public_names_are_importable():
+    import musestudio
+
+    for name in musestudio.__all__:
+        assert callable(getattr(musestudio, name))
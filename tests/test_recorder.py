@@ -0,0 +1,45 @@
+import time
+
+import numpy as np
+import pytest
+
+from musestudio import read_raw_xdf
+from musestudio.recorder import StreamRecorder
+
+pylsl_util = pytest.importorskip('pylsl.util')
+
+HEADER = (
+    '<?xml version="1.0"?><info><name>Muse-AAAA</name><type>EEG</type><channel_count>4</channel_count>'
+    '<nominal_srate>256</nominal_srate><channel_format>float32</channel_format><source_id>Muse-AAAA</source_id></info>'
+)
+
+class DisconnectedInlet:
+    '''Inlet whose clock offset never arrives, as for a device that lost its connection.'''
+    def __init__(self):
+        self.timeouts = []
+
+    def info(self):
+        return self
+
+    def as_xml(self):
+        return HEADER
+
+    def time_correction(self, timeout = 32000000.0):
+        self.timeouts.append(timeout)
+        time.sleep(min(timeout, 5))
+        raise(pylsl_util.TimeoutError('the operation failed due to a timeout.'))
+
+def test_disconnected_inlet_does_not_block_the_writer(tmp_path):
+    inlet = DisconnectedInlet()
+    filename = str(tmp_path / 'recording.xdf')
+    recorder = StreamRecorder(filename, [inlet], max_chunks=4, clock_interval=0.5)
+    recorder.start()
+
+    start = time.monotonic()
+    for index in range(16):
+        recorder.add_chunk(0, np.zeros((32, 4)), np.arange(32) / 256 + index / 8)
+    recorder.stop()
+
+    assert time.monotonic() - start < 5
+    assert all(timeout < 1 for timeout in inlet.timeouts)
+    assert len(read_raw_xdf(filename)[0][0]['time_stamps']) == 16 * 32